@@ -0,0 +1,57 @@
+"""Catalog load benchmark: packages.json (list of dicts) vs packages.bin (mmap record view).
+
+Writes a synthetic catalog of N entries (default 500k) in both formats to
+benchmarks/fixtures/, then loads each in a fresh interpreter and reports load
+time, resident memory after loading, and the time of a full pass over the
+entries and of a single system lookup.
+
+    python benchmarks/bench_catalog.py [entries]
+"""
+import os, sys, json, random, subprocess
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from retro.main import write_catalog
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+WORDS = "mario zelda sonic metroid kirby pokemon castlevania final fantasy dragon quest street fighter mega man contra tetris".split()
+
+PROBE = r"""
+import sys, time, json, resource
+sys.path.insert(0, sys.argv[1])
+def rss(): return int(open("/proc/self/statm").read().split()[1]) * resource.getpagesize() / 1024**2
+base = rss(); t = time.perf_counter()
+if sys.argv[2] == "json": files = json.load(open(sys.argv[3]))
+else:
+    from retro.main import CatalogView
+    base = rss(); t = time.perf_counter()
+    files = CatalogView(sys.argv[3])
+load, mem = time.perf_counter() - t, rss() - base
+t = time.perf_counter(); total = sum(f["size_bytes"] for f in files); scan = time.perf_counter() - t
+t = time.perf_counter()
+one = files.system("sys07") if sys.argv[2] == "bin" else [f for f in files if f["system"] == "sys07"]
+n = len(one); lookup = time.perf_counter() - t
+print(json.dumps([load, mem, scan, lookup, n]))
+"""
+
+def fixtures(n):  # Paths of the JSON and binary catalogs with n entries, generated once
+    js, bn = os.path.join(FIXTURES, f"catalog-{n}.json"), os.path.join(FIXTURES, f"catalog-{n}.bin")
+    if os.path.exists(js) and os.path.exists(bn): return js, bn
+    os.makedirs(FIXTURES, exist_ok=True)
+    rnd, rows = random.Random(n), []
+    for i in range(n):
+        sy = f"sys{i * 50 // n:02d}"
+        name = f"{rnd.choice(WORDS).title()} {rnd.choice(WORDS).title()} {i} ({rnd.choice(['USA', 'Europe', 'Japan'])}).zip"
+        size = rnd.randrange(1 << 16, 1 << 30)
+        rows.append((sy, name, name.replace(" ", "%20"), f"{size / 1024**2:.1f}M", size, f"https://myrient.erista.me/files/No-Intro/System {sy}/"))
+    json.dump([{"name": r[1], "link": r[2], "size_str": r[3], "size_bytes": r[4], "base": r[5], "system": r[0]} for r in rows], open(js, "w"))
+    write_catalog(bn, rows)
+    return js, bn
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    paths = dict(zip(("json", "bin"), fixtures(n)))
+    print(f"{n} entries")
+    print(f"{'format':<8}{'file MB':>9}{'load s':>9}{'RSS MB':>9}{'full pass s':>13}{'system s':>10}")
+    for fmt, path in paths.items():
+        load, mem, scan, lookup, _ = json.loads(subprocess.run([sys.executable, "-c", PROBE, ROOT, fmt, path], capture_output=True, text=True, check=True).stdout)
+        print(f"{fmt:<8}{os.path.getsize(path) / 1024**2:>9.1f}{load:>9.3f}{mem:>9.1f}{scan:>13.2f}{lookup:>10.4f}")
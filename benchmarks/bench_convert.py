@@ -0,0 +1,91 @@
+"""CHD conversion scheduling benchmark with a fake chdman on a simulated machine.
+
+The fake chdman (written next to the fixtures) converts its input at RATE
+bytes per second per core, with threads scaling by n / (1 + SERIAL * (n - 1)).
+Running fakes register their -np in a shared directory and split the
+simulated cores between them in proportion to it. Threads beyond the core
+count also cost context switches and cache misses: with T threads on C cores
+the work done shrinks by 1 + PENALTY * (T / C - 1). Without -np a fake uses
+every core, like chdman. Input files are sparse, only their size matters.
+
+Compares the previous scheduler (a fixed pool of workers in directory order,
+chdman picking its own thread count) with ConversionQueue (largest first,
+cores split between processes through -np) at the same worker count and
+with one worker per core, without and with the oversubscription penalty.
+Spawning a fake and its polling take real CPU time, so results are only
+meaningful on a machine with a few idle cores.
+
+    python benchmarks/bench_convert.py [cores] [penalty]
+"""
+import io, os, sys, time, shutil, random, contextlib, subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from concurrent.futures import ThreadPoolExecutor
+from retro.main import Converter
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RATE, SERIAL, TICK = 100 * 1024**2, 0.05, 0.1
+GB = 1024**3
+WORKLOAD = [int(4.4 * GB)] * 4 + [int(0.7 * GB)] * 12 + [int(0.15 * GB)] * 32  # DVD images, CD images, small CD images
+
+FAKE = f'''#!{sys.executable} -S
+import os, sys, time
+args = sys.argv[2:]
+src, out = args[args.index("-i") + 1], args[args.index("-o") + 1]
+cores, penalty = int(os.environ["FAKE_CHDMAN_CORES"]), float(os.environ["FAKE_CHDMAN_PENALTY"])
+np = int(args[args.index("-np") + 1]) if "-np" in args else cores
+state = os.environ["FAKE_CHDMAN_STATE"]
+me = os.path.join(state, str(os.getpid()))
+with open(me, "w") as f: f.write(str(np))
+def share(p):  # -np of another running fake, gone if it just finished
+    try: return int(open(os.path.join(state, p)).read() or 1)
+    except FileNotFoundError: return 0
+left, last = os.path.getsize(src), time.perf_counter()
+try:
+    while left > 0:
+        time.sleep({TICK})
+        demand = sum(share(p) for p in os.listdir(state))
+        n = np * min(1.0, cores / max(demand, 1)) / (1 + penalty * max(demand / cores - 1, 0))  # Cores this process gets
+        now = time.perf_counter()
+        left -= (now - last) * {RATE} * n / (1 + {SERIAL} * max(n - 1, 0)); last = now
+finally: os.remove(me)
+with open(out, "wb") as f: f.truncate(os.path.getsize(src) // 2)
+'''
+
+def setup(cores, penalty):  # Fresh sparse inputs in a shuffled order, and the fake chdman
+    root = os.path.join(FIXTURES, "convert")
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(os.path.join(root, "state"))
+    sizes = list(WORKLOAD); random.Random(1).shuffle(sizes)
+    for i, size in enumerate(sizes):
+        with open(os.path.join(root, f"Game {i:02d}.iso"), "wb") as f: f.truncate(size)
+    fake = os.path.join(root, "chdman")
+    with open(fake, "w") as f: f.write(FAKE)
+    os.chmod(fake, 0o755)
+    os.environ.update(FAKE_CHDMAN_CORES=str(cores), FAKE_CHDMAN_PENALTY=str(penalty), FAKE_CHDMAN_STATE=os.path.join(root, "state"))
+    return root, fake
+
+def legacy(root, fake, workers, cores):  # Fixed pool in directory order, no -np
+    def convert(f): subprocess.run([fake, "createcd", "-i", f, "-o", f[:-4] + ".chd", "-f"], check=True); os.remove(f)
+    with ThreadPoolExecutor(max_workers=workers) as exe:
+        list(exe.map(convert, sorted(os.path.join(root, n) for n in os.listdir(root) if n.endswith(".iso"))))
+
+def queued(root, fake, workers, cores):
+    c = Converter(); c.settings.update(chdman=fake, convert_cores=cores)
+    jobs = [c.job("iso_to_chd", os.path.join(root, n)) for n in sorted(os.listdir(root)) if n.endswith(".iso")]
+    assert c.run(jobs, workers)["done"] == len(jobs)
+
+if __name__ == "__main__":
+    cores = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    penalty = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    ideal = sum(WORKLOAD) / RATE / cores
+    print(f"{len(WORKLOAD)} images, {sum(WORKLOAD) / GB:.1f} GB, {cores} simulated cores, {ideal:.1f}s if every core ran single-threaded work")
+    print(f"{'scheduler':<46}{'no penalty':>12}{f'penalty {penalty}':>14}")
+    for label, fn, workers in (("fixed pool, 4 workers, no -np", legacy, 4), ("largest first, 4 workers, split -np", queued, 4),
+                               ("fixed pool, 1 worker per core, no -np", legacy, cores), ("largest first, 1 worker per core, split -np", queued, cores)):
+        times = []
+        for p in (0, penalty):
+            root, fake = setup(cores, p)
+            t = time.perf_counter()
+            with contextlib.redirect_stderr(io.StringIO()): fn(root, fake, workers, cores)  # No progress bar
+            times.append(time.perf_counter() - t)
+        print(f"{label:<46}{times[0]:>12.2f}{times[1]:>14.2f}")
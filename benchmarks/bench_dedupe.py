@@ -0,0 +1,69 @@
+"""Duplicate detection benchmark on a synthetic library of N ROM files (default 100k).
+
+Writes files of a few cartridge-like sizes (so most sizes collide) into
+benchmarks/fixtures/library/, with 2% byte-identical copies under other names
+and some files that only differ in the middle. Compares hashing every file in
+full with RomCleaner.identical (size buckets, first/last block hash, full hash
+of the survivors) on a cold library.db and again with the hashes cached.
+Bytes read matter more than time on a NAS; files written by this script are
+usually still in the page cache, so the time column favours the full scan.
+Sizes are scaled down to keep the fixture near 2.6 GB, so most files fit in
+the two blocks the quick hash reads, the worst case for bucketing; with real
+ROM sizes the quick pass reads 128 KiB per file.
+
+    python benchmarks/bench_dedupe.py [files]
+"""
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from retro.main import RomCleaner, LibraryIndex, QUICK_BLOCK, hash_file
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SIZES = [4096] * 30 + [8192] * 30 + [16384] * 20 + [32768] * 15 + [262144] * 4 + [524288]
+
+def library(n):  # Fixture library, written once per size
+    root = os.path.join(FIXTURES, f"library-{n}")
+    if os.path.exists(root): return root
+    rnd, made = random.Random(1), []
+    for i in range(n):
+        system = f"sys{i % 20:02d}"
+        os.makedirs(os.path.join(root, system), exist_ok=True)
+        path = os.path.join(root, system, f"Game {i} ({rnd.choice(['USA', 'Europe', 'Japan'])}).bin")
+        if made and rnd.random() < 0.02: data = open(rnd.choice(made), "rb").read()  # Renamed copy
+        else:
+            data = bytearray(rnd.randbytes(rnd.choice(SIZES)))
+            if len(data) > 2 * QUICK_BLOCK and made and rnd.random() < 0.1:  # Same edges as an earlier file, different middle
+                other = open(made[-1], "rb").read()
+                if len(other) == len(data): data[:QUICK_BLOCK], data[-QUICK_BLOCK:] = other[:QUICK_BLOCK], other[-QUICK_BLOCK:]
+        with open(path, "wb") as f: f.write(data)
+        made.append(path)
+    return root
+
+def full_scan(root):  # Hash every file, grouping identical digests
+    groups = {}
+    for system in os.listdir(root):
+        for name in os.listdir(os.path.join(root, system)):
+            path = os.path.join(root, system, name)
+            groups.setdefault((system, hash_file(path, ("sha1",))["sha1"]), []).append(path)
+    return sum(len(g) - 1 for g in groups.values() if len(g) > 1)
+
+def bucketed(root, db):
+    cleaner = RomCleaner(); cleaner.settings["roms_dir"] = root
+    return sum(len(g) - 1 for g in cleaner.identical(LibraryIndex(root, db)))
+
+def rchar(): return int(next(l for l in open("/proc/self/io") if l.startswith("rchar:")).split()[1])  # Bytes returned by read calls so far
+
+def timed(fn):
+    t, r = time.perf_counter(), rchar(); out = fn()
+    return out, rchar() - r, time.perf_counter() - t
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    root = library(n)
+    db = os.path.join(FIXTURES, f"library-{n}.db")
+    for p in (db, db + "-wal", db + "-shm"):
+        if os.path.exists(p): os.remove(p)
+    print(f"{n} files, {sum(len(os.listdir(os.path.join(root, s))) for s in os.listdir(root))} on disk")
+    print(f"{'method':<24}{'duplicates':>11}{'read MB':>10}{'seconds':>10}")
+    for label, fn in (("full hash of every file", lambda: full_scan(root)), ("bucketed, cold", lambda: bucketed(root, db)), ("bucketed, cached", lambda: bucketed(root, db))):
+        dups, read, t = timed(fn)
+        print(f"{label:<24}{dups:>11}{read / 1024**2:>10.1f}{t:>10.2f}")
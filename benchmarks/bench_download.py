@@ -0,0 +1,47 @@
+"""Install engine benchmark: asyncio (aiohttp) vs the threaded download stage.
+
+Installs N small ROMs (no extraction) from the local Range-capable server of
+check_download.py, which waits LATENCY seconds before each response to stand
+in for a network round trip. Each run gets a fresh roms_dir and a throwaway
+config directory (HOME points under benchmarks/fixtures), with the journal,
+disk checks and the download cache off. Requires aiohttp.
+
+    python benchmarks/bench_download.py [count] [latency]
+"""
+import io, os, sys, json, time, shutil, contextlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from check_download import Handler, serve, FIXTURES
+from retro.main import Manager, load_settings, aiohttp
+
+ROOT = os.path.join(FIXTURES, "install")
+
+class SlowHandler(Handler):  # Responses start after a simulated round trip
+    latency = 0.05
+    def do_GET(self): time.sleep(self.latency); super().do_GET()
+
+def run(pkgs, **settings):  # Seconds to install pkgs with the given settings into an empty roms_dir
+    shutil.rmtree(ROOT, ignore_errors=True)
+    os.environ["HOME"] = os.path.join(ROOT, "home")
+    load_settings()  # Creates the config directory with default settings
+    with open(os.path.join(ROOT, "home", ".config", "retro", "settings.json"), "w") as f: json.dump({"roms_dir": os.path.join(ROOT, "roms"), "journal": False, "disk_check": False, "library_watch": False, **settings}, f)
+    mgr = Manager(); mgr.systems = {"bench": {"format": ["nes"]}}
+    t = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()): results = mgr.install(pkgs)
+    elapsed = time.perf_counter() - t
+    assert all(r[0] == "done" for r in results), [r for r in results if r[0] != "done"][:3]
+    return elapsed
+
+if __name__ == "__main__":
+    if aiohttp is None: sys.exit("aiohttp is not installed, the async runs would fall back to threads")
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    SlowHandler.latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    files = {f"/Game_{i:04d}.nes": os.urandom(16 * 1024) for i in range(count)}
+    server, base = serve(files, SlowHandler)
+    pkgs = [{"system": "bench", "name": p[1:], "link": p[1:], "base": base, "size_str": "16 KiB", "size_bytes": 16 * 1024} for p in files]
+    print(f"{count} x 16 KiB ROMs, {SlowHandler.latency * 1000:.0f} ms per response")
+    for label, settings in (("threads, 20 workers", {"install_engine": "threads", "install_workers": 20}),
+                            ("async, concurrency 20", {"install_engine": "async", "async_concurrency": 20}),
+                            ("threads, 256 workers", {"install_engine": "threads", "install_workers": 256}),
+                            ("async, concurrency 256", {"install_engine": "async", "async_concurrency": 256})):
+        print(f"{label:<26}{run(pkgs, **settings):>8.2f}s")
+    server.shutdown()
@@ -0,0 +1,81 @@
+"""Directory listing parser benchmark: streaming tokenizer vs BeautifulSoup.
+
+Writes synthetic Myrient and archive.org style index pages of 1k/50k/200k rows to
+benchmarks/fixtures/ on first run, then times both parsers and their peak Python
+heap. Requires beautifulsoup4 for the reference parser.
+
+    python benchmarks/bench_listing.py [rows ...]
+"""
+import os, sys, time, random, tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bs4 import BeautifulSoup
+from retro.main import parse_listing, parse_size
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+URL = "https://example.org/files/No-Intro/Nintendo - Nintendo Entertainment System (Headered)/"
+
+def soup_listing(text, url):  # The BeautifulSoup parser get_directory_listing used before the tokenizer
+    soup = BeautifulSoup(text, "html.parser")
+    t = soup.find(lambda tag: tag.name == "table" and ("directory-listing-table" in tag.get("class", []) or tag.get("id") == "list"))
+    if not t: return []
+    h = [th.text.strip().lower() for th in t.find_all("th")]
+    name_idx, size_idx = h.index("name") if "name" in h else 0, h.index("size") if "size" in h else None
+    out, tbody = [], t.find("tbody")
+    if not tbody: return out
+    for tr in tbody.find_all("tr"):
+        td = tr.find_all("td")
+        if not td: continue
+        a = td[name_idx].find("a")
+        if not a: continue
+        if "parent directory" in a.text.lower(): continue
+        name, link = a.text.strip(), a["href"]
+        sz = td[size_idx].text.strip() if size_idx is not None and size_idx < len(td) else ((tr.find("td", class_="size") or (td[2] if len(td)>2 else None)))
+        sz = sz.text.strip() if hasattr(sz, "text") else (sz or "")
+        out.append({"name":name, "link":link, "size_str":sz, "size_bytes":parse_size(sz), "base":url})
+    return out
+
+def fixture(style, rows):  # Path of a saved synthetic listing, generated once
+    path = os.path.join(FIXTURES, f"{style}-{rows}.html")
+    if os.path.exists(path): return path
+    os.makedirs(FIXTURES, exist_ok=True)
+    rnd, regions = random.Random(rows), ["USA", "Europe", "Japan", "World", "USA, Europe", "Japan, USA"]
+    names = [f"Game {i:06d} &amp; Friends ({rnd.choice(regions)}){' (Rev 1)' if i % 7 == 0 else ''}.zip" for i in range(rows)]
+    sizes = [f"{rnd.uniform(0.1, 900):.1f} {rnd.choice(['KiB', 'MiB', 'GiB'])}" for _ in range(rows)]
+    with open(path, "w", encoding="utf-8") as f:
+        if style == "myrient":
+            f.write('<html><head><title>Index</title></head><body><table id="list"><thead><tr><th style="width:55%"><a href="?C=N&amp;O=A">File Name</a>&nbsp;<a href="?C=N&amp;O=D">&nbsp;&darr;&nbsp;</a></th>'
+                    '<th style="width:20%"><a href="?C=S&amp;O=A">File Size</a></th><th style="width:25%"><a href="?C=M&amp;O=A">Date</a></th></tr></thead>\n<tbody>\n'
+                    '<tr><td class="link"><a href="../">Parent directory/</a></td><td class="size">-</td><td class="date">-</td></tr>\n')
+            for n, sz in zip(names, sizes):
+                f.write(f'<tr><td class="link"><a href="{n.replace(" ", "%20")}" title="{n}">{n}</a></td><td class="size">{sz}</td><td class="date">01-Jan-2024 00:00</td></tr>\n')
+        else:
+            f.write('<html><body><div class="container"><table class="directory-listing-table"><thead><tr><th>Name</th><th>Last modified</th><th>Size</th></tr></thead><tbody>\n'
+                    '<tr><td><a href="../">Go to parent directory</a></td><td></td><td></td></tr>\n')
+            for n, sz in zip(names, sizes):
+                f.write(f'<tr><td><a href="{n.replace(" ", "%20")}">{n}</a></td><td>01-Jan-2024 00:00</td><td>{sz.replace(" ", "").replace("i", "")}</td></tr>\n')
+        f.write("</tbody></table></div></body></html>\n")
+    return path
+
+def measure(fn):  # Wall time of one call, then peak traced heap of a second one (tracing distorts timings)
+    t = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - t
+    tracemalloc.start(); fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+def chunks(path):  # Read a fixture the way get_directory_listing reads a response
+    with open(path, encoding="utf-8") as f:
+        for c in iter(lambda: f.read(65536), ""): yield c
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 50000, 200000]
+    print(f"{'fixture':<18}{'rows':>8}{'soup s':>10}{'stream s':>10}{'speedup':>9}{'soup MB':>10}{'stream MB':>11}")
+    for style in ("myrient", "archive"):
+        for rows in sizes:
+            path = fixture(style, rows)
+            a, ta, ma = measure(lambda: soup_listing(open(path, encoding="utf-8").read(), URL))
+            b, tb, mb = measure(lambda: list(parse_listing(chunks(path), URL)))
+            assert a == b and len(b) == rows, f"parsers disagree on {path}"
+            print(f"{style:<18}{rows:>8}{ta:>10.2f}{tb:>10.2f}{ta / tb:>8.1f}x{ma / 1024**2:>10.1f}{mb / 1024**2:>11.1f}")
@@ -0,0 +1,94 @@
+"""Filename metadata benchmark: 1G1R planning of a synthetic 200k-filename library.
+
+Compares RomCleaner.plan with the ranking it used before parse_name (two
+module-level regex calls per name, the rank table rebuilt per call and the
+tags lowercased again in every helper), cold (empty caches) and warm (names
+already parsed, e.g. by a search over the same catalog). Pure CPU, no file is
+opened; both plans are checked to keep the same files.
+
+    python benchmarks/bench_names.py [names]
+"""
+import os, re, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from retro.main import RomCleaner, REGION_TAGS, parse_name
+
+WORDS = "mario zelda sonic metroid kirby pokemon castlevania final fantasy dragon quest street fighter mega man contra tetris".split()
+TAGS = ["(USA)", "(Europe)", "(Japan)", "(World)", "(USA, Europe)", "(Japan, USA)", "(Rev 1)", "(Rev 2)", "(Beta)", "(Demo)", "(Proto)", "(En,Fr,De)", "(Hack)", "[!]", "[b1]", "(Disc 1)", "(Disc 2)", "(v1)", "(Final)"]
+
+class Legacy:  # RomCleaner's ranking before parse_name: per-call regexes, tag loops and rank table
+    def __init__(self, regions): self.regions = regions.split(",")
+
+    def _build_rank_table(self, user_regions):  # Build region priority table
+        rank_table = {}
+        for i, region in enumerate(user_regions):
+            rank_table[region] = i
+        return rank_table
+
+    def _clean_name(self, filename): return " ".join(re.sub(r'[\[\(].*?[\]\)]', '', filename).split())  # Remove brackets/parentheses
+
+    def _extract_tags(self, filename): return re.findall(r'[\[\(]([^\]\)]+)[\]\)]', filename)  # Extract tags from filename
+
+    def _get_region(self, tags):  # Determine region from tags, the preferred one for multi-region releases like (USA, Europe)
+        codes = {REGION_TAGS[t] for tag in tags for t in map(str.strip, tag.lower().split(",")) if t in REGION_TAGS}
+        return min(codes, key=lambda c: self._region_rank([c])) if codes else 'U'
+
+    def _region_rank(self, regions): return sum(self._build_rank_table(self.regions).get(r, 999) for r in regions)  # Calculate region priority
+
+    def _get_disc_info(self, tags):  # Extract disc/version info from tags
+        disc_info = {'disc': 1, 'version': 1, 'rev': 0}
+        for tag in tags:
+            if tag.lower().startswith('disc'): disc_info['disc'] = int(tag[4:].strip()) if tag[4:].strip().isdigit() else 1
+            elif tag.lower().startswith('v'): disc_info['version'] = int(tag[1:]) if tag[1:].isdigit() else 1
+            elif tag.lower().startswith('rev'): disc_info['rev'] = int(tag[3:].strip()) if tag[3:].strip().isdigit() else 1
+        return disc_info
+
+    def _build_rank(self, tags):  # Build ranking score for file selection
+        region = self._get_region(tags)
+        disc_info = self._get_disc_info(tags)
+        region_rank = self._region_rank([region])
+        purity_score = self._purity_score(tags, "")
+        return (region_rank, disc_info['disc'], -disc_info['version'], -disc_info['rev'], -purity_score)  # Latest version and revision first
+
+    def _purity_score(self, tags, filename):  # Calculate purity score for ROM quality
+        score = 0
+        for tag in tags:
+            tag_lower = tag.lower()
+            if tag_lower in ['w', 'e', 'u', 'j', 'usa', 'eur', 'jpn', 'pal', 'ntsc']: score += 10
+            elif tag_lower in ['final', 'complete', 'full']: score += 5
+            elif tag_lower in ['demo', 'beta', 'alpha', 'prototype']: score -= 20
+            elif tag_lower in ['hack', 'mod', 'patch']: score -= 10
+        return score
+
+    def _title_key(self, f):  # Files sharing a system, cleaned title and disc are variants of one game
+        return f["system"], self._clean_name(f["name"]), self._get_disc_info(self._extract_tags(f["name"]))['disc']
+
+    def plan(self, files):  # 1G1R over package or file dicts: the best ranked variant of every title in input order, and the others
+        groups = {}
+        for f in files: groups.setdefault(self._title_key(f), []).append(f)
+        best = {id(min(g, key=lambda f: (self._build_rank(self._extract_tags(f["name"])), f["name"]))) for g in groups.values()}
+        return [f for f in files if id(f) in best], [f for f in files if id(f) not in best]
+
+
+def names(n):  # Titles with several regional and revision variants each, as in a full set
+    rnd, out = random.Random(1), []
+    while len(out) < n:
+        title, system = " ".join(rnd.sample(WORDS, 3)) + f" {len(out)}", f"sys{len(out) % 20:02d}"
+        for _ in range(rnd.randint(1, 6)): out.append({"name": f"{title} {' '.join(rnd.sample(TAGS, rnd.randint(1, 3)))}.zip", "system": system})
+    return out[:n]
+
+def timed(fn):
+    t = time.perf_counter(); out = fn()
+    return out, time.perf_counter() - t
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    files = names(n)
+    old, t_old = timed(lambda: Legacy("W,E,U,J").plan(files)[0])
+    parse_name.cache_clear()
+    new, t_cold = timed(lambda: RomCleaner("W,E,U,J").plan(files)[0])
+    _, t_warm = timed(lambda: RomCleaner("W,E,U,J").plan(files)[0])
+    assert [id(f) for f in old] == [id(f) for f in new], "plans differ"
+    print(f"{n} names, {len(new)} kept")
+    print(f"{'legacy ranking':<20}{t_old:>8.2f} s")
+    print(f"{'parse_name, cold':<20}{t_cold:>8.2f} s")
+    print(f"{'parse_name, warm':<20}{t_warm:>8.2f} s")
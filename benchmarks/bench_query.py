@@ -0,0 +1,47 @@
+"""Query engine micro-benchmark on a synthetic 500k entry catalog.
+
+Compares the old per-entry list comprehension over a list of dicts (system
+names lowered per term, package names lowered per keyword) with Query.run on
+the memory-mapped catalog, cold (first query lowercases the visited
+partitions) and warm (lowercased names cached), and with the persisted
+token index (packages.idx) the web GUI searches through.
+
+    python benchmarks/bench_query.py [entries]
+"""
+import os, sys, json, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bench_catalog import fixtures
+from retro.main import CatalogView, NameIndex, Query
+
+QUERIES = ["mario", "mario zelda -japan", "sys07 sonic", "all sys07", "sys03 sys04 kirby -europe", "zzz"]
+
+def legacy(files, systems, terms):  # The scan search/search_for_install/api_search each carried
+    inc = [t.lower() for t in terms if t.lower() in [s.lower() for s in systems]]
+    kw = [t for t in terms if t.lower() not in [s.lower() for s in systems] and not t.startswith('-')]
+    exc = [t[1:] for t in terms if t.startswith('-')]
+    if len(terms) == 2 and terms[0].lower() == "all" and terms[1].lower() in [s.lower() for s in systems]:
+        return [f for f in files if f["system"].lower() == terms[1].lower()]
+    return [f for f in files if (not inc or f["system"].lower() in inc) and (not kw or all(k.lower() in f["name"].lower() for k in kw)) and (not exc or not any(e.lower() in f["name"].lower() for e in exc))]
+
+def timed(fn):
+    t = time.perf_counter(); out = fn()
+    return out, (time.perf_counter() - t) * 1000
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    js, bn = fixtures(n)
+    files, view = json.load(open(js)), CatalogView(bn)
+    systems = view.systems()
+    idx, st = bn[:-4] + ".idx", os.stat(bn)
+    _, tb = timed(lambda: NameIndex.build(view, idx, (st.st_size, st.st_mtime_ns)))
+    index, tl = timed(lambda: NameIndex(idx, (st.st_size, st.st_mtime_ns)))
+    print(f"{n} entries, {len(systems)} systems, index build {tb / 1000:.1f} s ({os.path.getsize(idx) / 1024**2:.1f} MB), load {tl:.1f} ms")
+    print(f"{'query':<28}{'hits':>7}{'legacy ms':>11}{'cold ms':>10}{'warm ms':>10}{'index ms':>10}")
+    for q in QUERIES:
+        terms = q.split()
+        a, ta = timed(lambda: legacy(files, systems, terms))
+        b, tc = timed(lambda: Query(terms, systems).run(view))
+        b, tw = timed(lambda: Query(terms, systems).run(view))
+        c, ti = timed(lambda: Query(terms, systems).run(view, index))
+        assert sorted(f["name"] for f in a) == sorted(f["name"] for f in b) == sorted(f["name"] for f in c), q
+        print(f"{q:<28}{len(b):>7}{ta:>11.1f}{tc:>10.1f}{tw:>10.1f}{ti:>10.2f}")
@@ -0,0 +1,101 @@
+"""Range download check against a local HTTP server with Range and If-Range support.
+
+Serves generated files from memory with a strong ETag per version, then checks
+that download_file fetches a large file in parallel segments, resumes an
+interrupted segmented download from its .parts progress, and starts over when
+the file changed on the server in between, and that the download cache only
+serves a file while its ETag still matches. Exits non-zero on the first failure.
+
+    python benchmarks/check_download.py
+"""
+import os, sys, shutil, hashlib, threading
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from retro.main import download_file, DownloadCache
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MB = 1024**2
+
+class Handler(BaseHTTPRequestHandler):  # GET with Range and If-Range, and an optional cut of each response after `cut` bytes
+    protocol_version, files, log, cut = "HTTP/1.1", {}, [], None
+
+    def log_message(self, *args): pass
+
+    def do_GET(self):
+        body = self.files.get(self.path)
+        if body is None: self.send_error(404); return
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        rng, cond = self.headers.get("Range"), self.headers.get("If-Range")
+        self.log.append((rng, cond))
+        start, end = 0, len(body) - 1
+        if rng and (cond is None or cond == etag):
+            a, b = rng.split("=", 1)[1].split("-")
+            start, end = int(a), min(int(b), end) if b else end
+            if start > end:
+                self.send_response(416); self.send_header("Content-Range", f"bytes */{len(body)}"); self.send_header("Content-Length", "0"); self.end_headers(); return
+            self.send_response(206); self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        else: self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1)); self.send_header("ETag", etag); self.send_header("Accept-Ranges", "bytes"); self.end_headers()
+        data = body[start:end + 1]
+        if self.cut is not None and len(data) > self.cut: data, self.close_connection = data[:self.cut], True  # Hang up mid-response like a flaky network
+        try: self.wfile.write(data)
+        except ConnectionError: pass  # The client stopped reading, e.g. after the probe of a segmented download
+
+    def do_HEAD(self):  # Conditional HEAD, as the download cache revalidates with
+        body = self.files.get(self.path)
+        if body is None: self.send_error(404); return
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        self.send_response(304 if self.headers.get("If-None-Match") == etag else 200)
+        self.send_header("ETag", etag); self.send_header("Content-Length", "0" if self.headers.get("If-None-Match") == etag else str(len(body))); self.end_headers()
+
+class Server(ThreadingHTTPServer): daemon_threads, request_queue_size = True, 1024  # Room for hundreds of concurrent connects
+
+def serve(files, handler=Handler):  # Start a background server for {path: bytes}, returns (server, base URL)
+    Handler.files, Handler.log, Handler.cut = files, [], None
+    server = Server(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def check(name, cond):
+    print(f"{'ok  ' if cond else 'FAIL'} {name}")
+    if not cond: sys.exit(1)
+
+if __name__ == "__main__":
+    root = os.path.join(FIXTURES, "download")
+    shutil.rmtree(root, ignore_errors=True); os.makedirs(root)
+    old, new = os.urandom(16 * MB), os.urandom(16 * MB)
+    files = {"/game.zip": old}
+    server, base = serve(files)
+    url, path = base + "/game.zip", os.path.join(root, "game.zip")
+
+    download_file(url, path, segment_threshold=MB, segment_workers=4, session=requests.Session())
+    check("segmented download matches", open(path, "rb").read() == old)
+    check("segmented download used 4 ranged requests", sum(1 for r, _ in Handler.log if r and r != "bytes=0-") == 4)
+    check("no progress left behind", not os.path.exists(path + ".parts"))
+
+    os.remove(path); Handler.log.clear(); Handler.cut = 5 * MB  # 2 segments of 8 MB, each saves 4 MB before the cut
+    try: download_file(url, path, segment_threshold=MB, segment_workers=2, session=requests.Session()); check("interrupted download raised", False)
+    except Exception: pass
+    check("interrupted download kept its progress", os.path.exists(path + ".parts"))
+    Handler.log.clear(); Handler.cut = None
+    download_file(url, path, segment_threshold=MB, segment_workers=2, session=requests.Session())
+    check("resumed download matches", open(path, "rb").read() == old)
+    check("resume asked only for missing ranges", {r for r, _ in Handler.log} == {"bytes=4194304-8388607", "bytes=12582912-16777215"})
+    check("resume sent If-Range", all(c for _, c in Handler.log))
+
+    os.remove(path); Handler.cut = 5 * MB
+    try: download_file(url, path, segment_threshold=MB, segment_workers=2, session=requests.Session())
+    except Exception: pass
+    files["/game.zip"], Handler.cut = new, None  # The file changes on the server before the resume
+    download_file(url, path, segment_threshold=MB, segment_workers=2, session=requests.Session())
+    check("changed file restarted from zero", open(path, "rb").read() == new)
+    check("no progress left behind", not os.path.exists(path + ".parts"))
+
+    os.remove(path)
+    cache, meta = DownloadCache(os.path.join(root, "cache"), 1 << 30), download_file(url, path, session=requests.Session())
+    cache.put(url, 16 * MB, meta, path)
+    check("cache serves an unchanged file", cache.get(url, 16 * MB, requests.Session()) is not None)
+    files["/game.zip"] = old  # Same listed size, different content
+    check("cache misses a changed file of the same size", cache.get(url, 16 * MB, requests.Session()) is None)
+    server.shutdown()
@@ -0,0 +1,27 @@
+"""Web GUI page check: the script of the served page must parse as JavaScript.
+
+HTML is a plain Python string, so a '\\n' written into its JavaScript turns into
+a line break inside a JS string literal and stops every button working. Renders
+/ with Flask's test client (HOME points under benchmarks/fixtures) and runs the
+inline script through `node --check`. Exits non-zero on failure. Requires node.
+
+    python benchmarks/check_web_gui.py
+"""
+import os, re, sys, shutil, subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+if __name__ == "__main__":
+    if not shutil.which("node"): sys.exit("node is not installed")
+    root = os.path.join(FIXTURES, "web_gui")
+    shutil.rmtree(root, ignore_errors=True); os.makedirs(root)
+    os.environ["HOME"] = root  # The module builds a Manager on import
+    from retro.web_gui import app
+    page = app.test_client().get("/").get_data(as_text=True)
+    scripts = re.findall(r"<script>(.*?)</script>", page, re.S)
+    path = os.path.join(root, "page.js")
+    with open(path, "w") as f: f.write("\n".join(scripts))
+    r = subprocess.run(["node", "--check", path], capture_output=True, text=True)
+    print(f"{'ok  ' if scripts and r.returncode == 0 else 'FAIL'} {len(scripts)} inline script(s) parse")
+    if not scripts or r.returncode: sys.exit(r.stderr)
@@ -1,8 +1,21 @@
-import os, re, json, shutil, subprocess, requests, zipfile, tarfile, py7zr, rarfile
+import os, re, sys, json, mmap, time, heapq, queue, bisect, sqlite3, asyncio, hashlib, shutil, struct, subprocess, threading, zlib, multiprocessing, requests, requests.adapters, zipfile, tarfile, py7zr, rarfile
 from glob import glob
-from bs4 import BeautifulSoup
+from stat import S_ISREG
+from array import array
+from itertools import accumulate
+from functools import lru_cache
+from collections import namedtuple
+from collections.abc import Sequence
+from xml.etree import ElementTree
+from html import unescape
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+try: import aiohttp  # Optional, enables the asyncio install engine
+except ImportError: aiohttp = None
+try: from py7zr.io import Py7zIO, WriterFactory  # Streaming 7z output, py7zr >= 0.22
+except ImportError: Py7zIO = WriterFactory = None
+try: from inotify_simple import INotify, flags as inotify_flags  # Optional, keeps the library index current while the web GUI runs
+except ImportError: INotify = inotify_flags = None
 
 def get_config_dir():  # Get configuration directory path
     config_dir = os.path.expanduser("~/.config/retro")
@@ -17,7 +30,32 @@ def load_settings():  # Load settings from config file
         "fetch_workers": 10,
         "install_workers": 20,
         "convert_workers": 4,
-        "compress_workers": 4
+        "compress_workers": 4,
+        "convert_cores": 0,
+        "chdman": "chdman",
+        "install_chd": False,
+        "chd_buffer": 16 * 1024**3,
+        "disk_check": True,
+        "min_free_bytes": 1024**3,
+        "extract_ratio": {"zip": 1.5, "7z": 2.0, "rar": 1.5, "tar.xz": 2.0},
+        "chd_ratio": 0.6,
+        "verify_workers": 0,
+        "web_install_jobs": 1,
+        "segment_threshold": 64 * 1024**2,
+        "segment_workers": 4,
+        "stream_extract": True,
+        "extract_workers": 0,
+        "install_engine": "threads",
+        "async_concurrency": 256,
+        "cache_enabled": False,
+        "cache_dir": os.path.expanduser("~/.cache/retro"),
+        "cache_max_bytes": 50 * 1024**3,
+        "journal": True,
+        "library_watch": True,
+        "preferred_regions": ["W", "E", "U", "J"],
+        "search_limit": 100,
+        "one_game_one_rom": False,
+        "hash_workers": 8
     }
     try:
         with open(settings_file, 'r') as f:
@@ -42,53 +80,1046 @@ def format_size(n):  # Convert bytes to human readable format
         n /= 1024
     return f"{n:.2f}PB"
 
-def download_file(url, path):  # Download file with resume support
-    path = os.path.normpath(path)
+_session, _session_lock = None, threading.Lock()
+
+def get_session(settings=None):  # Shared keep-alive HTTP session with per-host connection pools
+    global _session
+    settings = settings or load_settings()
+    size = max(settings["fetch_workers"], settings["install_workers"] * max(1, settings["segment_workers"]))
+    with _session_lock:
+        if _session is None or _session.pool_size < size:
+            s = requests.Session()
+            s.headers["User-Agent"] = "Mozilla/5.0"
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=size)
+            s.mount("http://", adapter); s.mount("https://", adapter)
+            s.pool_size, _session = size, s
+        return _session
+
+def download_file(url, path, segment_threshold=0, segment_workers=1, session=None, sink=None, progress=None):  # Download file with resume support
+    path, session = os.path.normpath(path), session or get_session()
     os.makedirs(os.path.dirname(path), exist_ok=True)
+    state = load_segments(path)
+    if state:
+        try: return download_segmented(url, path, state, session, progress)
+        except RemoteChanged:  # Stale parts from an older version of the file, start over
+            for p in (path, path + ".parts"):
+                if os.path.exists(p): os.remove(p)
     pos = os.path.getsize(path) if os.path.exists(path) else 0
-    total = int(requests.head(url).headers.get('content-length', 0))
-    headers = {'Range': f'bytes={pos}-'} if pos < total else {}
-    with requests.get(url, headers=headers, stream=True) as r, open(path, 'ab' if pos else 'wb') as f:
-        for c in r.iter_content(8192):
-            if c: f.write(c)
+    # A ranged GET reports the full length in Content-Range, so no separate HEAD is needed
+    with session.get(url, headers={'Range': f'bytes={pos}-', 'Accept-Encoding': 'identity'}, stream=True) as r:
+        if r.status_code == 416: return {}
+        r.raise_for_status()
+        ranged, total, meta = r.status_code == 206, response_total(r.status_code, r.headers, pos), validators(r.headers)
+        if ranged and not pos and segment_workers > 1 and segment_threshold and total >= segment_threshold:
+            r.close()
+            step = -(-total // segment_workers)
+            with open(path, 'wb') as f: f.truncate(total)
+            return download_segmented(url, path, {"total": total, "validators": meta, "segments": [[s, min(s + step, total) - 1, 0] for s in range(0, total, step)]}, session, progress)
+        if sink and pos and ranged: hash_file(path, sink=sink)  # Resumed, hash the part already on disk
+        with open(path, 'ab' if pos and ranged else 'wb') as f:
+            for c in r.iter_content(65536):
+                if c:
+                    f.write(c)
+                    if sink: sink.update(c)
+                    if progress: progress(len(c))
     if os.path.getsize(path) < total: raise Exception(f"Incomplete download: {path}")
+    return meta
+
+class HashSink:  # Incremental CRC32/MD5/SHA1 of bytes as they are written
+    def __init__(self, algos=()):
+        self.count, self.crc = 0, 0 if "crc" in algos else None
+        self.hashes = {a: hashlib.new(a) for a in algos if a != "crc"}
+
+    def update(self, b):
+        self.count += len(b)
+        if self.crc is not None: self.crc = zlib.crc32(b, self.crc)
+        for h in self.hashes.values(): h.update(b)
+
+    def hexdigests(self):
+        out = {a: h.hexdigest() for a, h in self.hashes.items()}
+        if self.crc is not None: out["crc"] = f"{self.crc:08x}"
+        return out
+
+def hash_file(path, algos=(), sink=None):  # Hash a file on disk, for writes that could not be hashed inline
+    sink = sink or HashSink(algos)
+    with open(path, 'rb') as f:
+        for b in iter(lambda: f.read(1024**2), b""): sink.update(b)
+    return sink.hexdigests()
+
+def validators(headers): return {"etag": headers.get("etag"), "last_modified": headers.get("last-modified")}  # Cache validators of a response
+
+def response_total(status, headers, pos=0):  # Full resource length from a plain or ranged response
+    cr = headers.get('content-range', '').rsplit('/', 1)[-1]
+    if status == 206 and cr.isdigit(): return int(cr)
+    return int(headers.get('content-length', 0)) + (pos if status == 206 else 0)
+
+class RemoteChanged(Exception): pass  # The remote file changed since an interrupted download started, its parts cannot be stitched together
+
+def if_range(meta):  # If-Range validator of a stored response: a strong ETag, else Last-Modified
+    etag = meta.get("etag")
+    return etag if etag and not etag.startswith("W/") else meta.get("last_modified")
+
+def load_segments(path):  # Load segment progress of an interrupted segmented download
+    state_path = path + ".parts"
+    if not os.path.exists(state_path): return None
+    try:
+        state = json.load(open(state_path))
+        if os.path.getsize(path) == state["total"]: return state
+    except: pass
+    for p in (path, state_path):  # Unusable progress, start over
+        if os.path.exists(p): os.remove(p)
+    return None
+
+def download_segmented(url, path, state, session=None, progress=None):  # Download byte ranges in parallel into a preallocated file
+    state_path, lock, session = path + ".parts", threading.Lock(), session or get_session()
+    headers, changed, validator = {'Accept-Encoding': 'identity'}, threading.Event(), if_range(state.get("validators", {}))
+    if validator: headers['If-Range'] = validator  # A 200 instead of 206 then means the file changed
+
+    def save():  # Persist per-segment progress atomically
+        with open(state_path + ".tmp", 'w') as f: json.dump(state, f)
+        os.replace(state_path + ".tmp", state_path)
+
+    def fetch(seg):  # Fetch remaining bytes of one segment at its offset
+        start, end, done = seg
+        if start + done > end: return
+        with session.get(url, headers={**headers, 'Range': f'bytes={start + done}-{end}'}, stream=True) as r, open(path, 'r+b') as f:
+            if r.status_code == 200 and 'If-Range' in headers:  # Validator no longer matches, the server sent the whole new file
+                changed.set(); raise RemoteChanged(url)
+            if r.status_code != 206: raise Exception(f"Server ignored range request: {url}")
+            f.seek(start + done); unsaved = 0
+            for c in r.iter_content(65536):
+                if changed.is_set(): break  # Another segment saw the file change, these bytes are stale
+                if not c: continue
+                f.write(c); unsaved += len(c)
+                if progress: progress(len(c))
+                if unsaved >= 4 * 1024**2:
+                    f.flush()
+                    with lock: seg[2] += unsaved; save()
+                    unsaved = 0
+            f.flush()
+            with lock: seg[2] += unsaved; save()
+
+    save()
+    with ThreadPoolExecutor(max_workers=len(state["segments"])) as exe:
+        for fut in [exe.submit(fetch, seg) for seg in state["segments"]]: fut.result()
+    if any(s + d <= e for s, e, d in state["segments"]): raise Exception(f"Incomplete download: {path}")
+    os.remove(state_path)
+    return state.get("validators", {})
+
+def write_member(src, target, algos=()):  # Copy an archive member to target via a .part file, returns its digests
+    sink, part = HashSink(algos), part_path(target)
+    try:
+        with open(part, 'wb') as out:
+            for b in iter(lambda: src.read(65536), b""): out.write(b); sink.update(b)
+        os.replace(part, target)
+    except BaseException:
+        if os.path.exists(part): os.remove(part)
+        raise
+    return sink.hexdigests()
+
+class SevenZipWriter(Py7zIO or object):  # py7zr output that writes one member to disk while hashing it
+    def __init__(self, target, algos): self.target, self.file, self.sink = target, open(part_path(target), 'wb'), HashSink(algos)
+    def write(self, s): self.file.write(s); self.sink.update(s); return len(s)
+    def read(self, size=None): return b""
+    def seek(self, offset, whence=0): return self.file.tell()
+    def flush(self): self.file.flush()
+    def size(self): return self.sink.count
 
-def extract_archive(fp, dst, ext):  # Extract various archive formats
+    def close(self):
+        if not self.file.closed: self.file.close(); os.replace(part_path(self.target), self.target)
+
+class SevenZipWriters(WriterFactory or object):  # py7zr writer factory collecting member digests
+    def __init__(self, dst, algos): self.dst, self.algos, self.writers = dst, algos, {}
+    def create(self, filename): self.writers[filename] = SevenZipWriter(safe_path(self.dst, filename), self.algos); return self.writers[filename]
+
+    def finish(self):  # Close every member (older py7zr never calls close) and return digests
+        for w in self.writers.values(): w.close()
+        return {n: w.sink.hexdigests() for n, w in self.writers.items()}
+
+def extract_archive(fp, dst, ext, algos=()):  # Extract various archive formats, returns member digests
     fp, dst = os.path.normpath(fp), os.path.normpath(dst)
     os.makedirs(dst, exist_ok=True)
-    extractors = {"zip": lambda: zipfile.ZipFile(fp).extractall(dst), "tar.xz": lambda: tarfile.open(fp, "r:xz").extractall(dst), "7z": lambda: py7zr.SevenZipFile(fp, mode="r").extractall(dst), "rar": lambda: rarfile.RarFile(fp).extractall(dst)}
-    if ext not in extractors: raise Exception(f"Unsupported archive: {ext}")
-    extractors[ext]()
-
-def get_directory_listing(url):  # Parse directory listing from web page
-    r = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-    soup = BeautifulSoup(r.text, "html.parser")
-    t = soup.find(lambda tag: tag.name == "table" and ("directory-listing-table" in tag.get("class", []) or tag.get("id") == "list"))
-    if not t: return []
-    h = [th.text.strip().lower() for th in t.find_all("th")]
-    name_idx, size_idx = h.index("name") if "name" in h else 0, h.index("size") if "size" in h else None
-    out, tbody = [], t.find("tbody")
-    if not tbody: return out
-    for tr in tbody.find_all("tr"):
-        td = tr.find_all("td")
-        if not td: continue
-        a = td[name_idx].find("a")
-        if not a: continue
-        if "parent directory" in a.text.lower(): continue
-        name, link = a.text.strip(), a["href"]
-        sz = td[size_idx].text.strip() if size_idx is not None and size_idx < len(td) else ((tr.find("td", class_="size") or (td[2] if len(td)>2 else None)))
-        sz = sz.text.strip() if hasattr(sz, "text") else (sz or "")
-        out.append({"name":name, "link":link, "size_str":sz, "size_bytes":parse_size(sz), "base":url})
-    return out
+    if ext not in ("zip", "tar.xz", "7z", "rar"): raise Exception(f"Unsupported archive: {ext}")
+    digests = {}
+    if ext == "7z":
+        with py7zr.SevenZipFile(fp, mode="r") as z:
+            if WriterFactory:
+                writers = SevenZipWriters(dst, algos)
+                z.extractall(factory=writers); return writers.finish()
+            names = z.getnames(); z.extractall(dst)
+        return {n: hash_file(os.path.join(dst, n), algos) for n in names if os.path.isfile(os.path.join(dst, n))}
+    if ext == "tar.xz":
+        with tarfile.open(fp, "r:xz") as t:
+            for m in t:
+                if not m.isfile(): continue
+                with t.extractfile(m) as src: digests[m.name] = write_member(src, safe_path(dst, m.name), algos)
+        return digests
+    with (zipfile.ZipFile(fp) if ext == "zip" else rarfile.RarFile(fp)) as z:
+        for m in z.infolist():
+            if m.is_dir(): continue
+            with z.open(m) as src: digests[m.filename] = write_member(src, safe_path(dst, m.filename), algos)
+    return digests
+
+STREAM_FORMATS = ("zip", "tar.xz")  # Archives that can be unpacked front to back
+
+class StreamUnsupported(Exception): pass  # Archive needs random access, use the temp-file path
+
+class InstallCancelled(Exception): pass  # Raised out of a running download once its install is cancelled
+
+class InstallMonitor:  # Live view of an install for other threads: its stage counters and downloaded bytes, and a flag to cancel it
+    def __init__(self): self.stats, self.cancel = {}, threading.Event()
+
+class ResponseReader:  # File-like reader with pushback over a streaming HTTP response
+    def __init__(self, r, tee=None, progress=None): self.chunks, self.buf, self.tee, self.progress = r.iter_content(65536), b"", tee, progress
+
+    def _next(self):  # Pull the next network chunk, copying it to the tee file
+        c = next(self.chunks, None)
+        if c is not None and self.tee: self.tee.write(c)
+        if c is not None and self.progress: self.progress(len(c))
+        return c
+
+    def read(self, n=-1):  # Read up to n bytes, or everything left when n < 0
+        while n < 0 or len(self.buf) < n:
+            c = self._next()
+            if c is None: break
+            self.buf += c
+        if n < 0: n = len(self.buf)
+        out, self.buf = self.buf[:n], self.buf[n:]
+        return out
+
+    def read1(self):  # Read whatever is available next
+        if self.buf: out, self.buf = self.buf, b""; return out
+        return self._next() or b""
+
+    def drain(self):  # Consume the rest of the stream, so the tee holds the whole archive
+        while self._next() is not None: pass
+
+    def exact(self, n):  # Read exactly n bytes
+        b = self.read(n)
+        if len(b) < n: raise Exception("Truncated archive stream")
+        return b
+
+    def unread(self, b): self.buf = b + self.buf
+
+def safe_path(dst, name):  # Join an archive member name under dst, refusing path traversal
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+    if not parts or ".." in parts: raise Exception(f"Unsafe archive member: {name}")
+    target = os.path.join(dst, *parts)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    return target
+
+def part_path(target): return os.path.join(os.path.dirname(target), "." + os.path.basename(target) + ".part")  # Hidden name used while a file is being written
+
+def stream_zip(rd, dst, written, digests, algos=()):  # Extract ZIP entries from their local headers in stream order
+    while True:
+        sig = rd.exact(4)
+        if sig in (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06"): return  # Central directory reached
+        if sig != b"PK\x03\x04": raise StreamUnsupported("Unexpected ZIP record")
+        _, flags, method, _, _, crc, csize, usize, nlen, xlen = struct.unpack("<HHHHHIIIHH", rd.exact(26))
+        name, extra = rd.exact(nlen).decode("utf-8" if flags & 0x800 else "cp437"), rd.exact(xlen)
+        if flags & 1 or method not in (0, 8) or (flags & 8 and method == 0): raise StreamUnsupported(f"ZIP entry needs random access: {name}")
+        zip64, i = False, 0
+        while i + 4 <= len(extra):  # Zip64 sizes live in extra field 0x0001
+            xid, xsz = struct.unpack("<HH", extra[i:i + 4])
+            if xid == 1:
+                zip64, vals = True, list(struct.unpack(f"<{xsz // 8}Q", extra[i + 4:i + 4 + xsz - xsz % 8]))
+                if usize == 0xFFFFFFFF and vals: usize = vals.pop(0)
+                if csize == 0xFFFFFFFF and vals: csize = vals.pop(0)
+            i += 4 + xsz
+        target = safe_path(dst, name)
+        if name.endswith("/"): os.makedirs(target, exist_ok=True); rd.exact(csize); continue
+        written.append(part_path(target)); calc, sink = 0, HashSink(algos)
+        with open(written[-1], "wb") as out:
+            if method == 0:
+                left = csize
+                while left:
+                    b = rd.exact(min(left, 65536)); out.write(b); calc = zlib.crc32(b, calc); sink.update(b); left -= len(b)
+            else:
+                d = zlib.decompressobj(-15)
+                while not d.eof:
+                    b = rd.read1()
+                    if not b: raise Exception("Truncated archive stream")
+                    b = d.decompress(b); out.write(b); calc = zlib.crc32(b, calc); sink.update(b)
+                rd.unread(d.unused_data)
+        if flags & 8:  # Sizes and CRC follow the data in a descriptor
+            desc = rd.exact(4)
+            if desc == b"PK\x07\x08": desc = rd.exact(4)
+            crc = struct.unpack("<I", desc)[0]; rd.exact(16 if zip64 else 8)
+        if calc != crc: raise Exception(f"CRC mismatch: {name}")
+        os.replace(written[-1], target); written[-1], digests[name] = target, sink.hexdigests()
+
+def stream_tar(rd, dst, written, digests, algos=()):  # Extract regular files from a tar.xz stream
+    with tarfile.open(fileobj=rd, mode="r|xz") as tf:
+        for m in tf:
+            if not m.isfile(): continue
+            with tf.extractfile(m) as src: digests[m.name] = write_member(src, safe_path(dst, m.name), algos)
+            written.append(safe_path(dst, m.name))
+
+def stream_extract(url, dst, ext, session=None, tee=None, algos=(), progress=None):  # Extract an archive while it downloads, returns member digests
+    if ext not in STREAM_FORMATS: raise StreamUnsupported(f"Unsupported archive: {ext}")
+    dst, written, digests = os.path.normpath(dst), [], {}
+    os.makedirs(dst, exist_ok=True)
+    try:
+        with (session or get_session()).get(url, headers={'Accept-Encoding': 'identity'}, stream=True) as r:
+            r.raise_for_status()
+            rd = ResponseReader(r, tee, progress)
+            (stream_zip if ext == "zip" else stream_tar)(rd, dst, written, digests, algos)
+            if tee: rd.drain()
+            meta = validators(r.headers)
+    except BaseException:
+        for p in written:  # Never leave half an archive behind
+            if os.path.exists(p): os.remove(p)
+        raise
+    return digests, meta
+
+def link_or_copy(src, dst):  # Materialize a file by hardlink, reflink or copy, cheapest first
+    if os.path.exists(dst): os.remove(dst)
+    try: os.link(src, dst); return "link"
+    except OSError: pass
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d: fcntl.ioctl(d.fileno(), 0x40049409, s.fileno())  # FICLONE
+        return "reflink"
+    except (ImportError, OSError): pass
+    shutil.copyfile(src, dst); return "copy"
+
+class DownloadCache:  # Content-addressed blob cache of downloaded packages with LRU eviction
+    def __init__(self, root, max_bytes):
+        self.root, self.max_bytes, self.lock = os.path.expanduser(root), max_bytes, threading.Lock()
+        self.index_path = os.path.join(self.root, "index.json")
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        try: self.index = json.load(open(self.index_path))
+        except: self.index = {}
+
+    def _save(self):  # Persist the index atomically, caller holds the lock
+        with open(self.index_path + ".tmp", 'w') as f: json.dump(self.index, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _blob(self, key): return os.path.join(self.root, "blobs", key[:2], key)  # Blob path for a content key
+
+    def get(self, url, listed_size, session=None):  # Blob path for url if cached at the catalog size and still current upstream, else None
+        with self.lock:
+            e = self.index.get(url)
+            if not e or e["listed"] != listed_size or not os.path.exists(self._blob(e["key"])): return None
+            e = dict(e)
+        if not self.current(url, e, session): return None  # The catalog size is rounded, a changed file can list the same
+        with self.lock:
+            if self.index.get(url, {}).get("key") == e["key"]: self.index[url]["atime"] = time.time(); self._save()
+        return self._blob(e["key"])
+
+    def current(self, url, e, session=None):  # Revalidate an entry's ETag/Last-Modified with a conditional HEAD, entries without validators go by size alone
+        headers = {k: e[v] for k, v in (("If-None-Match", "etag"), ("If-Modified-Since", "last_modified")) if e.get(v)}
+        if not headers: return True
+        try: r = (session or get_session()).head(url, headers=headers, allow_redirects=True, timeout=30)
+        except requests.RequestException: return False
+        if r.status_code == 304: return True
+        return r.ok and all(e.get(k) is None or e[k] == v for k, v in validators(r.headers).items())  # Servers may ignore conditions on HEAD
+
+    def put(self, url, listed_size, meta, src, move=False):  # Add a downloaded file, returns the blob path
+        key = hashlib.sha256(f"{url}\n{listed_size}\n{meta.get('etag')}\n{meta.get('last_modified')}".encode()).hexdigest()
+        blob = self._blob(key)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if move: os.replace(src, blob)
+        else: link_or_copy(src, blob + ".part"); os.replace(blob + ".part", blob)
+        with self.lock:
+            old = self.index.get(url)
+            if old and old["key"] != key and os.path.exists(self._blob(old["key"])): os.remove(self._blob(old["key"]))
+            self.index[url] = {"key": key, "listed": listed_size, "size": os.path.getsize(blob), "atime": time.time(), **meta}
+            self._evict(); self._save()
+        return blob
+
+    def writer(self, url):  # Open a temporary blob to tee a streamed download into
+        path = self._blob(hashlib.sha256(url.encode()).hexdigest()) + ".part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, 'wb')
+
+    def _evict(self):  # Drop least recently used blobs until under max_bytes, caller holds the lock
+        total = sum(e["size"] for e in self.index.values())
+        for url, e in sorted(self.index.items(), key=lambda kv: kv[1]["atime"]):
+            if total <= self.max_bytes: break
+            if os.path.exists(self._blob(e["key"])): os.remove(self._blob(e["key"]))
+            total -= e["size"]; del self.index[url]
+
+def package_url(f): return f["base"].rstrip("/") + "/" + f["link"]  # Download URL of a catalog entry
+
+def package_ext(name): return "tar.xz" if name.endswith(".tar.xz") else os.path.splitext(name)[1].lstrip(".").lower()  # Archive or ROM type of a package file name
+
+class InstallJournal:  # SQLite journal of install jobs so interrupted bulk installs resume where they stopped
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.executescript("""
+            PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, query TEXT, created REAL, finished REAL, options TEXT);
+            CREATE TABLE IF NOT EXISTS packages (job INTEGER, url TEXT, system TEXT, pkg TEXT, state TEXT, offset INTEGER DEFAULT 0, error TEXT, updated REAL, PRIMARY KEY (job, url));
+            CREATE TABLE IF NOT EXISTS installed (url TEXT PRIMARY KEY, files TEXT);
+        """)
+        if "options" not in [c[1] for c in self.db.execute("PRAGMA table_info(jobs)")]: self.db.execute("ALTER TABLE jobs ADD COLUMN options TEXT")  # Journals of older versions
+
+    def start(self, query, pkgs, options=None):  # Record a new job with every package queued and the install options it ran with, returns its id
+        with self.lock:
+            job, now = self.db.execute("INSERT INTO jobs (query, created, options) VALUES (?, ?, ?)", (query, time.time(), json.dumps(options or {}))).lastrowid, time.time()
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO packages (job, url, system, pkg, state, updated) VALUES (?, ?, ?, ?, 'queued', ?)",
+                                [(job, package_url(f), f["system"], json.dumps(f), now) for f in pkgs])
+            self.db.execute("COMMIT")
+        return job
+
+    def resumable(self):  # Latest job with unfinished packages as (id, query, packages, states, options), or None
+        with self.lock:
+            row = self.db.execute("SELECT p.job, j.query, j.options FROM packages p JOIN jobs j ON j.id = p.job WHERE p.state != 'done' ORDER BY p.job DESC LIMIT 1").fetchone()
+            if not row: return None
+            rows = self.db.execute("SELECT url, pkg, state FROM packages WHERE job = ? AND state != 'done'", (row[0],)).fetchall()
+        return row[0], row[1], [json.loads(p) for _, p, _ in rows], {u: st for u, _, st in rows}, json.loads(row[2] or "{}")
+
+    def mark(self, job, url, state, offset=None, error=None):  # Move a package to a new state
+        with self.lock:
+            self.db.execute("UPDATE packages SET state = ?, offset = COALESCE(?, offset), error = ?, updated = ? WHERE job = ? AND url = ?", (state, offset, error, time.time(), job, url))
+
+    def installed(self, url, files):  # Remember the files a package produced
+        with self.lock: self.db.execute("INSERT OR REPLACE INTO installed (url, files) VALUES (?, ?)", (url, json.dumps(files)))
+
+    def is_installed(self, url, dest):  # O(1) check that a journaled install is still on disk under dest, the system directory it would go to now
+        with self.lock: row = self.db.execute("SELECT files FROM installed WHERE url = ?", (url,)).fetchone()
+        files, dest = json.loads(row[0]) if row else [], os.path.join(os.path.normpath(dest), "")
+        return bool(files) and all(os.path.normpath(p).startswith(dest) and os.path.exists(p) for p in files)
+
+    def pending_names(self, sys_name):  # Package names of unfinished journal entries for a system
+        with self.lock: rows = self.db.execute("SELECT pkg FROM packages WHERE system = ? AND state != 'done'", (sys_name,)).fetchall()
+        return {json.loads(p)["name"] for p, in rows}
+
+    def finish(self, job):
+        with self.lock: self.db.execute("UPDATE jobs SET finished = ? WHERE id = ?", (time.time(), job))
+
+CATALOG_MAGIC = b"RCAT\x01\x00\x00\x00"
+
+QUICK_BLOCK = 65536
+
+def quick_hash(path, size):  # SHA-1 of the first and last QUICK_BLOCK bytes, enough to tell most same-size files apart
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        h.update(f.read(QUICK_BLOCK))
+        if size > QUICK_BLOCK: f.seek(max(QUICK_BLOCK, size - QUICK_BLOCK)); h.update(f.read(QUICK_BLOCK))
+    return h.hexdigest()
+
+def file_entry(st, prev):  # Index entry (size, mtime, hash, quick hash) of a stat result, keeping the hashes while size and mtime match
+    return (st.st_size, st.st_mtime_ns) + (prev[2:] if prev and prev[:2] == (st.st_size, st.st_mtime_ns) else (None, None))
+
+class LibraryIndex:  # Size, mtime and optional hashes of every file under roms_dir in library.db, rescanned per directory only when its mtime changes
+    def __init__(self, roms_dir, path=":memory:"):
+        self.roms_dir, self.lock, self.dirs, self.watched = roms_dir, threading.Lock(), {}, set()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.executescript("""
+            PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS dirs (system TEXT PRIMARY KEY, mtime INTEGER);
+            CREATE TABLE IF NOT EXISTS files (system TEXT, name TEXT, size INTEGER, mtime INTEGER, hash TEXT, quick TEXT, PRIMARY KEY (system, name));
+            CREATE TABLE IF NOT EXISTS checks (system TEXT, name TEXT, size INTEGER, mtime INTEGER, ok INTEGER, detail TEXT, PRIMARY KEY (system, name));
+        """)
+        if "quick" not in [c[1] for c in self.db.execute("PRAGMA table_info(files)")]: self.db.execute("ALTER TABLE files ADD COLUMN quick TEXT")
+
+    def _load(self, sys_name):  # Stored entry of a system, read from library.db once per process
+        e = self.dirs.get(sys_name)
+        if e is None:
+            row = self.db.execute("SELECT mtime FROM dirs WHERE system=?", (sys_name,)).fetchone()
+            if row: e = self.dirs[sys_name] = {"mtime": row[0], "files": {n: tuple(v) for n, *v in self.db.execute("SELECT name, size, mtime, hash, quick FROM files WHERE system=?", (sys_name,))}}
+        return e
+
+    def _store(self, sys_name, old, e):  # Write the difference between two entries of a system to library.db
+        gone = [(sys_name, n) for n in old.keys() - e["files"].keys()]
+        rows = [(sys_name, n, *v) for n, v in e["files"].items() if old.get(n) != v]
+        self.db.execute("BEGIN")
+        self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (sys_name, e["mtime"]))
+        self.db.executemany("DELETE FROM files WHERE system=? AND name=?", gone)
+        self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.db.execute("COMMIT")
+
+    def _entry(self, sys_name):  # Current {mtime, files: {name: (size, mtime, hash, quick hash)}} of a system directory, None when it does not exist
+        with self.lock:
+            e = self._load(sys_name)
+            if e is not None and sys_name in self.watched: return e
+        d = os.path.join(self.roms_dir, sys_name)
+        try: mtime = os.stat(d).st_mtime_ns
+        except OSError: return None
+        if e is not None and e["mtime"] == mtime: return e
+        old, files = e["files"] if e else {}, {}
+        with os.scandir(d) as it:
+            for x in it:
+                try:
+                    if not x.is_file(): continue
+                    st = x.stat()
+                except OSError: continue
+                files[x.name] = file_entry(st, old.get(x.name))
+        # A directory changed within the timestamp granularity could change again unnoticed, rescan it next time
+        e = {"mtime": None if time.time_ns() - mtime < 2 * 10**9 else mtime, "files": files}
+        with self.lock:
+            self.dirs[sys_name] = e
+            self._store(sys_name, old, e)
+        return e
+
+    def files(self, sys_name):  # {name: (size, mtime, hash, quick hash)} of the visible files in a system directory
+        e = self._entry(sys_name)
+        return {n: v for n, v in e["files"].items() if not n.startswith('.')} if e else {}
+
+    def names(self, sys_name): return list(self.files(sys_name))  # Visible file names in a system directory
+
+    def size(self, sys_name, name):  # Indexed size of a file, 0 when it is not in the index
+        e = self._entry(sys_name)
+        return e["files"].get(name, (0,))[0] if e else 0
+
+    def bases(self, sys_name):  # File names without extension, which is how an installed package is recognised
+        e = self._entry(sys_name)
+        if not e: return set()
+        if "bases" not in e: e["bases"] = {os.path.splitext(n)[0] for n in e["files"]}
+        return e["bases"]
+
+    def installed(self, f): return os.path.splitext(f["name"])[0] in self.bases(f["system"])
+
+    def digest(self, sys_name, name, quick=False): return self.digests([(sys_name, name)], quick).get((sys_name, name))  # SHA-1 of one file, or its quick_hash
+
+    def digests(self, files, quick=False, workers=1):  # {(system, name): SHA-1 or quick_hash}, hashing only files whose size or mtime changed since
+        col, entries, out, todo = 3 if quick else 2, {}, {}, []
+        for sys_name, name in files:
+            if sys_name not in entries: entries[sys_name] = self._entry(sys_name)
+            v = entries[sys_name] and entries[sys_name]["files"].get(name)
+            if v and v[col] is not None: out[sys_name, name] = v[col]
+            elif v: todo.append((sys_name, name, v))
+        
+        def work(jobs):  # Hash a chunk of files, unreadable ones are left out of the result
+            out = []
+            for sys_name, name, v in jobs:
+                path = os.path.join(self.roms_dir, sys_name, name)
+                try: out.append(quick_hash(path, v[0]) if quick else hash_file(path, ("sha1",))["sha1"])
+                except OSError: out.append(None)
+            return out
+        
+        # Chunks keep the per-task overhead small next to hashing thousands of small ROMs; hashlib and reads release the GIL
+        with ThreadPoolExecutor(max_workers=workers) as exe: hashes = [h for chunk in exe.map(work, [todo[i:i + 256] for i in range(0, len(todo), 256)]) for h in chunk]
+        rows = []
+        with self.lock:  # Stored in one transaction, a file replaced meanwhile keeps its new entry
+            for (sys_name, name, v), h in zip(todo, hashes):
+                if h is None: continue
+                out[sys_name, name], e = h, self.dirs.get(sys_name)
+                cur = e and e["files"].get(name)
+                if cur and cur[:2] == v[:2]: e["files"][name] = cur[:col] + (h,) + cur[col + 1:]
+                rows.append((h, sys_name, name, v[0], v[1]))
+            if rows:
+                self.db.execute("BEGIN")
+                self.db.executemany(f"UPDATE files SET {'quick' if quick else 'hash'}=? WHERE system=? AND name=? AND size=? AND mtime=?", rows)
+                self.db.execute("COMMIT")
+        return out
+
+    def restat(self, files):  # Re-stat (system, name) pairs and refresh their entries; a file rewritten in place leaves its directory mtime alone
+        changed = {}
+        for sys_name, name in files: changed.setdefault(sys_name, set()).add(name)
+        for sys_name in changed: self._entry(sys_name)  # Loaded, so _apply has an entry to update
+        self._apply(changed)
+
+    def rescan(self, systems):  # Re-stat every file of the given systems whatever their directory mtime, returns how many files are indexed
+        with self.lock:
+            for sys_name in systems:
+                e = self._load(sys_name)
+                if e: e["mtime"] = None
+                self.watched.discard(sys_name)
+        return sum(len(self.files(s)) for s in systems)
+
+    def checks(self, sys_name):  # Last integrity check of files in a system, {name: (size, mtime, ok, detail)} as of that check
+        with self.lock: return {n: tuple(v) for n, *v in self.db.execute("SELECT name, size, mtime, ok, detail FROM checks WHERE system=?", (sys_name,))}
+
+    def store_checks(self, rows, gone=()):  # Record (system, name, size, mtime, ok, detail) check results and forget (system, name) of deleted files
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO checks VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.db.executemany("DELETE FROM checks WHERE system=? AND name=?", gone)
+            self.db.execute("COMMIT")
+
+    def _apply(self, changed):  # Refresh the files named by a batch of inotify events, {system: {name}}
+        for sys_name, names in changed.items():
+            stats = {}
+            for n in names:
+                try: st = os.stat(os.path.join(self.roms_dir, sys_name, n))
+                except OSError: st = None
+                stats[n] = st if st and S_ISREG(st.st_mode) else None
+            with self.lock:
+                e = self._load(sys_name)
+                if e is None: continue
+                old, files = e["files"], dict(e["files"])  # Replaced rather than mutated, readers may be iterating the old dict
+                for n, st in stats.items():
+                    if st is None: files.pop(n, None)
+                    else: files[n] = file_entry(st, old.get(n))
+                e = self.dirs[sys_name] = {"mtime": e["mtime"], "files": files}
+                self._store(sys_name, old, e)
+
+    def watch(self, systems):  # Follow system directories with inotify instead of stat'ing them, for long-running processes like the web GUI
+        if INotify is None: return False
+        ino, wds, fl = INotify(), {}, inotify_flags
+        mask = fl.CREATE | fl.DELETE | fl.MOVED_FROM | fl.MOVED_TO | fl.CLOSE_WRITE | fl.ATTRIB | fl.DELETE_SELF | fl.MOVE_SELF
+        for sys_name in systems:
+            try: wds[ino.add_watch(os.path.join(self.roms_dir, sys_name), mask)] = sys_name
+            except OSError: continue  # Directories created later are still checked by mtime
+            if self._entry(sys_name) is not None:  # Rescanned after the watch exists so no change falls in between
+                with self.lock: self.watched.add(sys_name)
+
+        def run():
+            while True:
+                changed = {}
+                for ev in ino.read():
+                    if ev.mask & fl.Q_OVERFLOW:  # Events were lost, go back to mtime checks with a forced rescan
+                        with self.lock:
+                            for s in self.watched: self.dirs[s]["mtime"] = None
+                            self.watched.clear()
+                        return
+                    sys_name = wds.get(ev.wd)
+                    if sys_name is None: continue
+                    if ev.mask & (fl.DELETE_SELF | fl.MOVE_SELF | fl.IGNORED):
+                        with self.lock: self.watched.discard(sys_name)
+                    elif ev.name: changed.setdefault(sys_name, set()).add(ev.name)
+                if changed: self._apply(changed)
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+def open_library(settings): return LibraryIndex(settings["roms_dir"], os.path.join(get_config_dir(), "library.db"))  # Library index shared by every command
+
+def write_catalog(path, rows):  # Write packages.bin from (system, name, link, size_str, size_bytes, base) rows grouped by system
+    # Layout: magic, record count, JSON table of systems (record ranges) and interned bases, then 8-aligned
+    # size_bytes u64[], base index u32[], name/link/size_str end offsets u32[] and the three UTF-8 blobs
+    systems, bases, base_ids, base_idx, sizes = [], [], {}, array("I"), array("Q")
+    for i, (sy, _, _, _, sb, b) in enumerate(rows):
+        if not systems or systems[-1][0] != sy: systems.append([sy, i, i])
+        systems[-1][2] = i + 1
+        if b not in base_ids: base_ids[b] = len(bases); bases.append(b)
+        base_idx.append(base_ids[b]); sizes.append(sb or 0)
+    meta = json.dumps({"systems": systems, "bases": bases}).encode()
+    with open(path + ".tmp", "wb") as f:
+        f.write(CATALOG_MAGIC + struct.pack("<QQ", len(rows), len(meta)) + meta + b"\0" * (-len(meta) % 8))
+        f.write(sizes.tobytes()); f.write(base_idx.tobytes())
+        blobs = [[r[col].encode() for r in rows] for col in (1, 2, 3)]
+        for blob in blobs: f.write(array("I", [0] + list(accumulate(map(len, blob)))).tobytes())
+        for blob in blobs: f.write(b"".join(blob))
+    os.replace(path + ".tmp", path)
+
+class CatalogView(Sequence):  # Read-only record sequence over an mmap of packages.bin, entries become dicts only when accessed
+    def __init__(self, path, lo=0, hi=None, _parts=None):
+        if _parts is None:
+            with open(path, "rb") as f: mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[:8] != CATALOG_MAGIC: raise ValueError(f"Not a catalog file: {path}")
+            count, meta_len = struct.unpack_from("<QQ", mm, 8)
+            meta, buf, pos = json.loads(mm[24:24 + meta_len]), memoryview(mm), 24 + meta_len + (-meta_len % 8)
+            arrays = []
+            for fmt, n in (("Q", count), ("I", count), ("I", count + 1), ("I", count + 1), ("I", count + 1)):
+                arrays.append(buf[pos:pos + n * struct.calcsize(fmt)].cast(fmt)); pos += n * struct.calcsize(fmt)
+            blobs = []
+            for offs in arrays[2:]: blobs.append(buf[pos:pos + offs[-1]]); pos += offs[-1]
+            _parts = (mm, meta["systems"], [s[1] for s in meta["systems"]], meta["bases"], arrays, blobs, {})
+        self._parts, self.lo, self.hi = _parts, lo, len(_parts[4][1]) if hi is None else hi
+        self.sizes = _parts[4][0][self.lo:self.hi]
+
+    def __len__(self): return self.hi - self.lo
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1: return CatalogView(None, self.lo + start, self.lo + max(start, stop), self._parts)
+            return [self[j] for j in range(start, stop, step)]
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError("catalog index out of range")
+        return self.record(self.lo + i)
+
+    def __iter__(self): return map(self.record, range(self.lo, self.hi))
+
+    def _text(self, col, i):
+        offs, blob = self._parts[4][2 + col], self._parts[5][col]
+        return str(blob[offs[i]:offs[i + 1]], "utf-8")
+
+    def name(self, i): return self._text(0, i)  # Name of the record at absolute index i without building a dict
+
+    def record(self, i):  # Package dict of the record at absolute index i
+        _, systems, starts, bases, arrays, _, _ = self._parts
+        return {"name": self._text(0, i), "link": self._text(1, i), "size_str": self._text(2, i), "size_bytes": arrays[0][i],
+                "base": bases[arrays[1][i]], "system": systems[bisect.bisect_right(starts, i) - 1][0]}
+
+    def systems(self): return [s[0] for s in self._parts[1] if s[1] < self.hi and s[2] > self.lo]
+
+    def system(self, sys_name):  # Sub-view of one system's records
+        for name, lo, hi in self._parts[1]:
+            if name == sys_name: return CatalogView(None, max(lo, self.lo), max(min(hi, self.hi), max(lo, self.lo)), self._parts)
+        return CatalogView(None, self.lo, self.lo, self._parts)
+
+    def total_size(self): return sum(self.sizes)
+
+    def totals(self, ids):  # {system: (count, bytes)} of sorted absolute record ids, without building records
+        sizes, out = self._parts[4][0], {}
+        for name, lo, hi in self._parts[1]:
+            a, b = bisect.bisect_left(ids, lo), bisect.bisect_left(ids, hi)
+            if a < b: out[name] = (b - a, sum(sizes[i] for i in ids[a:b]))
+        return out
+
+    def lower_text(self):  # Lowercased names of this range joined by newlines, with each name's start offset, computed once per mapping
+        cache, key = self._parts[6], (self.lo, self.hi)
+        if key not in cache:
+            offs, blob = self._parts[4][2], self._parts[5][0]
+            text = str(blob[offs[self.lo]:offs[self.hi]], "utf-8")
+            if text.isascii():  # Byte offsets are character offsets, slice one lowered string
+                text, base = text.lower(), offs[self.lo]
+                names = [text[offs[i] - base:offs[i + 1] - base] for i in range(self.lo, self.hi)]
+            else: names = [self.name(i).lower() for i in range(self.lo, self.hi)]
+            cache[key] = ("\n".join(names), array("I", [0] + list(accumulate(len(n) + 1 for n in names))))
+        return cache[key]
+
+    def find(self, k):  # Indices (relative to this view) of names containing lowercase k, one str.find per hit
+        text, starts = self.lower_text()
+        out, pos = [], text.find(k)
+        while pos >= 0:
+            i = bisect.bisect_right(starts, pos) - 1
+            out.append(i); pos = text.find(k, starts[i + 1])
+        return out
+
+REGION_TAGS = {"w": "W", "world": "W", "e": "E", "eur": "E", "europe": "E", "pal": "E", "u": "U", "us": "U", "usa": "U", "ntsc": "U", "j": "J", "jp": "J", "jpn": "J", "japan": "J"}
+TAG_SCORES = {**dict.fromkeys(['w', 'e', 'u', 'j', 'usa', 'eur', 'jpn', 'pal', 'ntsc'], 10), **dict.fromkeys(['final', 'complete', 'full'], 5),
+              **dict.fromkeys(['demo', 'beta', 'alpha', 'prototype'], -20), **dict.fromkeys(['hack', 'mod', 'patch'], -10)}
+NAME_TAG = re.compile(r'[\[\(](.*?)[\]\)]')  # re.split alternates text and tag contents
+NameMeta = namedtuple("NameMeta", "clean title regions disc version rev purity")
+
+@lru_cache(maxsize=4096)
+def parse_tag(tag):  # (purity score, region codes, disc, version, revision) of one tag, None where it says nothing; libraries repeat few distinct tags
+    t, disc, version, rev = tag.lower(), None, None, None
+    codes = tuple(REGION_TAGS[p.strip()] for p in t.split(",") if p.strip() in REGION_TAGS)
+    if t.startswith('disc'): disc = int(t[4:].strip()) if t[4:].strip().isdigit() else 1
+    elif t.startswith('v'): version = int(t[1:]) if t[1:].isdigit() else 1
+    elif t.startswith('rev'): rev = int(t[3:].strip()) if t[3:].strip().isdigit() else 1
+    return TAG_SCORES.get(t, 0), codes, disc, version, rev
+
+@lru_cache(maxsize=1 << 18)
+def parse_name(name):  # Metadata of a ROM or package name from one pass over its tags, cached per name for search, install planning and autoremove
+    parts, regions, disc, version, rev, purity = NAME_TAG.split(name), (), 1, 1, 0, 0
+    for tag in parts[1::2]:
+        score, codes, d, v, r = parse_tag(tag)
+        purity += score
+        if codes: regions += codes
+        if d is not None: disc = d
+        if v is not None: version = v
+        if r is not None: rev = r
+    clean = " ".join("".join(parts[::2]).split())  # Keeps extension and case, autoremove groups by it
+    dot = clean.rfind(".")
+    return NameMeta(clean, " ".join((clean[:dot] if dot > 0 else clean).lower().split()), frozenset(regions), disc, version, rev, purity)
+
+class Query:  # Search terms compiled once: included systems, lowercased keywords and -exclusions
+    def __init__(self, terms, systems):
+        lower = {s.lower(): s for s in systems}
+        if len(terms) == 2 and terms[0].lower() == "all" and terms[1].lower() in lower: terms = [terms[1]]  # Whole system
+        self.systems = [lower[t.lower()] for t in terms if t.lower() in lower]  # Empty means every system
+        self.kw = [t.lower() for t in terms if t.lower() not in lower and not t.startswith('-')]
+        self.exc = [t[1:].lower() for t in terms if t.startswith('-')]
+        self.title = " ".join(self.kw)
+
+    def match(self, name): return self._lowered(name.lower())  # Name test with today's case-insensitive substring semantics
+
+    def __call__(self, f): return (not self.systems or f["system"] in self.systems) and self.match(f["name"])
+
+    def run(self, view, index=None): return [view.record(i) for i in self.ids(view, index)]  # Matching records of a CatalogView
+
+    def ids(self, view, index=None):  # Sorted absolute record ids of the matches, visiting only the partitions of the included systems
+        if index and self.kw: return index.matches(self, view)
+        out = []
+        for sys_name in self.systems or view.systems():
+            part = view.system(sys_name)
+            if not self.kw and not self.exc: out.extend(range(part.lo, part.hi)); continue
+            if self.kw:  # Candidates from the longest keyword, then check the rest on the lowered names
+                text, starts = part.lower_text()
+                hits = [i for i in part.find(max(self.kw, key=len)) if self._lowered(text[starts[i]:starts[i + 1] - 1])]
+            else:
+                dropped = {i for e in self.exc for i in part.find(e)}
+                hits = [i for i in range(len(part)) if i not in dropped]
+            out.extend(part.lo + i for i in hits)
+        out.sort()
+        return out
+
+    def rank(self, name, regions):  # Sort key of a matching name, lower is better: exact title, earliest keyword, preferred region
+        n, meta = name.lower(), parse_name(name)
+        region = min((regions[r] for r in meta.regions if r in regions), default=len(regions))
+        return (0 if self.kw and meta.title == self.title else 1, min((n.find(k) for k in self.kw), default=0), region)
+
+    def ranked(self, view, ids, regions=(), after=None, limit=None):  # (key, record) of the matches in rank order, only the best `limit` kept in a heap
+        order = {r: i for i, r in enumerate(regions)}
+        keys = (self.rank(view.name(i), order) + (i,) for i in ids)  # The record id breaks ties, so keys are unique and a cursor is exact
+        if after is not None: keys = (key for key in keys if key > after)
+        if limit:
+            for key in heapq.nsmallest(limit, keys): yield key, view.record(key[-1])
+            return
+        heap = list(keys); heapq.heapify(heap)  # Popped lazily, the first lines print before the rest is ordered
+        while heap:
+            key = heapq.heappop(heap); yield key, view.record(key[-1])
+
+    @staticmethod
+    def cursor(key): return ".".join(map(str, key))  # Opaque page cursor: the rank key of the last record shown
+
+    @staticmethod
+    def after(cursor): return tuple(map(int, cursor.split(".")))  # Rank key of a page cursor, ValueError when malformed
+
+    def _lowered(self, n): return all(k in n for k in self.kw) and not any(e in n for e in self.exc)
+
+INDEX_MAGIC = b"RIDX\x01\x00\x00\x00"
+
+class NameIndex:  # Inverted index from whitespace tokens of lowercased names to record ids, mmapped from packages.idx
+    # Keywords never contain whitespace, so a name contains a keyword exactly when one of its tokens does: lookups
+    # scan the token vocabulary (one string, str.find) instead of every name and give exact substring results
+    def __init__(self, path, stamp):
+        with open(path, "rb") as f: mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:8] != INDEX_MAGIC or list(struct.unpack_from("<QQ", mm, 8)) != list(stamp): raise ValueError(f"Stale index: {path}")
+        tokens, text_len = struct.unpack_from("<QQ", mm, 24)
+        buf, pos = memoryview(mm), 40 + text_len + (-text_len % 4)
+        self.vocab = str(buf[40:40 + text_len], "utf-8")
+        self.starts = buf[pos:pos + 4 * (tokens + 1)].cast("I"); pos += 4 * (tokens + 1)
+        self.offs = buf[pos:pos + 4 * (tokens + 1)].cast("I"); pos += 4 * (tokens + 1)
+        self.postings, self.mm = buf[pos:pos + 4 * self.offs[-1]].cast("I"), mm
+
+    @staticmethod
+    def build(view, path, stamp):  # Index every name of a CatalogView and write packages.idx
+        post = {}
+        for sys_name in view.systems():
+            part = view.system(sys_name)
+            for i, n in enumerate(part.lower_text()[0].split("\n"), part.lo):
+                for t in set(n.split()): post.setdefault(t, array("I")).append(i)
+        vocab = sorted(post)
+        text = "\n".join(vocab).encode()
+        with open(path + ".tmp", "wb") as f:
+            f.write(INDEX_MAGIC + struct.pack("<QQQQ", *stamp, len(vocab), len(text)) + text + b"\0" * (-len(text) % 4))
+            f.write(array("I", [0] + list(accumulate(len(t) + 1 for t in vocab))).tobytes())
+            f.write(array("I", [0] + list(accumulate(len(post[t]) for t in vocab))).tobytes())
+            for t in vocab: f.write(post[t].tobytes())
+        os.replace(path + ".tmp", path)
+
+    def tokens(self, k):  # Vocabulary numbers of the tokens containing lowercase k
+        out, pos = [], self.vocab.find(k)
+        while pos >= 0:
+            t = bisect.bisect_right(self.starts, pos) - 1
+            out.append(t); pos = self.vocab.find(k, self.starts[t + 1])
+        return out
+
+    def ids(self, tokens, ranges=None):  # Record ids of the given tokens, optionally only inside [lo, hi) record ranges
+        out = set()
+        for t in tokens:
+            p = self.postings[self.offs[t]:self.offs[t + 1]]  # Ascending, so ranges are cut out by bisection
+            if ranges is None: out.update(p)
+            else:
+                for lo, hi in ranges: out.update(p[bisect.bisect_left(p, lo):bisect.bisect_left(p, hi)])
+        return out
+
+    def matches(self, query, view):  # Intersect keyword candidates inside the included systems, exclusions checked on the survivors
+        ranges = [(p.lo, p.hi) for p in map(view.system, query.systems)] if query.systems else None
+        hits = set.intersection(*sorted((self.ids(self.tokens(k), ranges) for k in query.kw), key=len))
+        return sorted(hits) if not query.exc else [i for i in sorted(hits) if query.match(view.name(i))]
+
+class Catalog:  # SQLite package catalog keyed by system, with an FTS5 trigram index for substring search on names
+    SELECT = "SELECT p.name, p.link, p.size_str, p.size_bytes, l.url, p.system FROM packages p JOIN listings l ON l.id = p.listing"
+
+    def __init__(self, path):
+        self.lock, self.bin = threading.Lock(), os.path.join(os.path.dirname(path), "packages.bin")
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.executescript("""
+            PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS listings (id INTEGER PRIMARY KEY, url TEXT UNIQUE NOT NULL, etag TEXT, last_modified TEXT);
+            CREATE TABLE IF NOT EXISTS packages (id INTEGER PRIMARY KEY, system TEXT NOT NULL, listing INTEGER NOT NULL, name TEXT NOT NULL, link TEXT, size_str TEXT, size_bytes INTEGER);
+            CREATE INDEX IF NOT EXISTS packages_system ON packages (system);
+        """)
+        try:  # The trigram tokenizer needs SQLite 3.34+, older builds fall back to LIKE scans
+            self.db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(name, content='packages', content_rowid='id', tokenize='trigram');
+                CREATE TRIGGER IF NOT EXISTS packages_ai AFTER INSERT ON packages BEGIN INSERT INTO names (rowid, name) VALUES (new.id, new.name); END;
+                CREATE TRIGGER IF NOT EXISTS packages_ad AFTER DELETE ON packages BEGIN INSERT INTO names (names, rowid, name) VALUES ('delete', old.id, old.name); END;
+            """)
+            self.fts = True
+        except sqlite3.OperationalError: self.fts = False
+
+    def _rows(self, sql, args=()):
+        with self.lock: rows = self.db.execute(sql, args).fetchall()
+        return [{"name": n, "link": l, "size_str": ss, "size_bytes": sb, "base": b, "system": sy} for n, l, ss, sb, b, sy in rows]
+
+    def count(self):
+        with self.lock: return self.db.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+
+    def system(self, sys_name): return self._rows(self.SELECT + " WHERE p.system = ? ORDER BY p.id", (sys_name,))
+
+    def listings(self):  # Stored validators of every listing URL
+        with self.lock: return {u: {"etag": e, "last_modified": lm} for u, e, lm in self.db.execute("SELECT url, etag, last_modified FROM listings")}
+
+    def store(self, sys_name, files, listings):  # Replace the packages of a system in one transaction
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.execute("DELETE FROM packages WHERE system = ?", (sys_name,))
+                ids = {}
+                for url in {f["base"] for f in files}:
+                    v = listings.get(url, {})
+                    self.db.execute("INSERT INTO listings (url, etag, last_modified) VALUES (?, ?, ?) ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified", (url, v.get("etag"), v.get("last_modified")))
+                    ids[url] = self.db.execute("SELECT id FROM listings WHERE url = ?", (url,)).fetchone()[0]
+                self.db.executemany("INSERT INTO packages (system, listing, name, link, size_str, size_bytes) VALUES (?, ?, ?, ?, ?, ?)",
+                                    [(sys_name, ids[f["base"]], f["name"], f["link"], f["size_str"], f["size_bytes"]) for f in files])
+                self.db.execute("COMMIT")
+            except BaseException: self.db.execute("ROLLBACK"); raise
+
+    def prune(self, systems):  # Drop systems that are no longer configured and listings nothing refers to, returns dropped packages
+        with self.lock:
+            n = self.db.execute(f"DELETE FROM packages WHERE system NOT IN ({','.join('?' * len(systems))})", list(systems)).rowcount
+            self.db.execute("DELETE FROM listings WHERE id NOT IN (SELECT DISTINCT listing FROM packages)")
+        return n
+
+    def export(self):  # Rewrite the packages.bin snapshot from the database
+        with self.lock: rows = self.db.execute("SELECT p.system, p.name, p.link, p.size_str, p.size_bytes, l.url FROM packages p JOIN listings l ON l.id = p.listing ORDER BY p.system, p.id").fetchall()
+        write_catalog(self.bin, rows)
+
+    def view(self):  # Whole catalog as a lazy mmap-backed sequence
+        if not os.path.exists(self.bin): self.export()
+        return CatalogView(self.bin)
+
+    def index(self, view):  # Name index of the current snapshot, rebuilt when packages.idx is missing or stale
+        path, st = os.path.join(os.path.dirname(self.bin), "packages.idx"), os.stat(self.bin)
+        stamp = (st.st_size, st.st_mtime_ns)
+        try: return NameIndex(path, stamp)
+        except (OSError, ValueError): NameIndex.build(view, path, stamp)
+        return NameIndex(path, stamp)
+
+    def search(self, query):  # Run a compiled Query with the system index and the trigram index narrowing candidates
+        sql, args, match = self.SELECT + " WHERE 1", [], [k for k in query.kw if len(k) >= 3] if self.fts else []
+        if query.systems: sql += f" AND p.system IN ({','.join('?' * len(query.systems))})"; args += query.systems
+        if match: sql += " AND p.id IN (SELECT rowid FROM names WHERE names MATCH ?)"; args.append(" AND ".join('"' + k.replace('"', '""') + '"' for k in match))
+        for k in query.kw:  # Trigrams cannot match shorter keywords; SQLite LIKE folds only ASCII case, others are left to Query.match
+            if k not in match and k.isascii(): sql += " AND p.name LIKE ? ESCAPE '\\'"; args.append("%" + re.sub(r"([%_\\])", r"\\\1", k) + "%")
+        # The indexes narrow candidates, Query.match keeps the Python str.lower() semantics
+        return [f for f in self._rows(sql + " ORDER BY p.id", args) if query.match(f["name"])]
+
+HTML_TOKEN = re.compile(r'([^<]+)|<(/?)([A-Za-z][A-Za-z0-9]*)([^>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^>"\']*)*)>|<!--.*?-->|<[^>]*>', re.S)
+HTML_ATTR = re.compile(r'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+
+def html_attrs(s): return [(m.group(1).lower(), unescape(m.group(2) or m.group(3) or m.group(4) or "")) for m in HTML_ATTR.finditer(s)]
+
+class ListingParser:  # Regex tokenizer over an index page, collects rows of the listing table without building a DOM
+    def __init__(self, url):
+        self.url, self.rows, self.headers, self.buf = url, [], [], ""
+        self.depth, self.done, self.tbody = 0, False, None  # tbody is None before, True inside and False after the first tbody
+        self.th = self.tr = self.td = self.a = None
+
+    def feed(self, text):  # Tokenize complete markup, keeping the tail from the last '<' for the next chunk
+        self.buf += text
+        cut = self.buf.rfind("<")
+        if cut <= 0: return
+        self._tokens(self.buf[:cut]); self.buf = self.buf[cut:]
+
+    def close(self): self._tokens(self.buf); self.buf = ""
+
+    def _tokens(self, s):
+        for data, end, tag, attrs in HTML_TOKEN.findall(s):
+            if data:
+                if self.depth: self.handle_data(unescape(data))
+            elif not tag: continue  # Comments, doctype
+            elif end: self.handle_endtag(tag.lower())
+            else:
+                tag = tag.lower()
+                self.handle_starttag(tag, html_attrs(attrs) if tag in ("table", "td", "a") else ())
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            if self.depth: self.depth += 1
+            elif not self.done:
+                a = dict(attrs)
+                if "directory-listing-table" in (a.get("class") or "").split() or a.get("id") == "list": self.depth = 1
+            return
+        if not self.depth: return
+        if tag == "th": self.th = []
+        elif tag == "tbody" and self.tbody is None: self.tbody = True
+        elif tag == "tr" and self.tbody:
+            self._row(); self.tr = []
+        elif tag == "td" and self.tr is not None:
+            self.td = [[], None, "size" in (dict(attrs).get("class") or "").split()]  # text, (href, link text), is size column
+            self.tr.append(self.td); self.a = None
+        elif tag == "a" and self.td is not None and self.td[1] is None:
+            self.a = self.td[1] = (dict(attrs).get("href") or "", [])
+
+    def handle_endtag(self, tag):
+        if not self.depth: return
+        if tag == "th" and self.th is not None: self.headers.append("".join(self.th).strip().lower()); self.th = None
+        elif tag == "a": self.a = None
+        elif tag == "td": self.td = self.a = None
+        elif tag == "tr": self._row()
+        elif tag == "tbody" and self.tbody: self._row(); self.tbody = False
+        elif tag == "table":
+            self.depth -= 1
+            if not self.depth: self._row(); self.done = True
+
+    def handle_data(self, d):
+        if not self.depth: return
+        if self.th is not None: self.th.append(d)
+        if self.td is not None: self.td[0].append(d)
+        if self.a is not None: self.a[1].append(d)
+
+    def _row(self):  # Turn the open table row into a package dict
+        cells, self.tr, self.td, self.a = self.tr, None, None, None
+        if not cells: return
+        h = self.headers
+        name_idx, size_idx = h.index("name") if "name" in h else 0, h.index("size") if "size" in h else None
+        if name_idx >= len(cells) or not cells[name_idx][1]: return
+        link, text = cells[name_idx][1]
+        name = "".join(text).strip()
+        if "parent directory" in name.lower(): return
+        if size_idx is not None and size_idx < len(cells): sz = cells[size_idx]
+        else: sz = next((c for c in cells if c[2]), cells[2] if len(cells) > 2 else None)
+        sz = "".join(sz[0]).strip() if sz else ""
+        self.rows.append({"name":name, "link":link, "size_str":sz, "size_bytes":parse_size(sz), "base":self.url})
+
+def parse_listing(chunks, url):  # Stream package dicts out of an index page given as text chunks
+    p = ListingParser(url)
+    for c in chunks:
+        p.feed(c)
+        rows, p.rows = p.rows, []
+        yield from rows
+        if p.done: return  # Rest of the page is never read
+    p.close(); yield from p.rows
+
+def get_directory_listing(url, session=None, cond=None):  # Parse directory listing from web page
+    # With a cond dict of stored validators the request is conditional, None means unchanged, and cond receives the new validators
+    headers = {k: v for k, v in (("If-None-Match", (cond or {}).get("etag")), ("If-Modified-Since", (cond or {}).get("last_modified"))) if v}
+    with (session or get_session()).get(url, headers=headers, stream=True) as r:
+        if r.status_code == 304: return None
+        r.raise_for_status()
+        if cond is not None: cond.clear(); cond.update(validators(r.headers))
+        r.encoding = r.encoding or "utf-8"
+        return list(parse_listing(r.iter_content(65536, decode_unicode=True), url))
 
 class Manager:  # Main package manager class
     def __init__(self, cfg=None): 
         self.config_dir = get_config_dir()
         self.cfg = cfg or os.path.join(self.config_dir, "systems.json")
         self.settings = load_settings()
-        self.systems, self.files = {}, []
+        self.session = get_session(self.settings)
+        self.cache = DownloadCache(self.settings["cache_dir"], self.settings["cache_max_bytes"]) if self.settings["cache_enabled"] else None
+        self.journal = InstallJournal(os.path.join(self.config_dir, "journal.db")) if self.settings["journal"] else None
+        self.catalog = Catalog(os.path.join(self.config_dir, "catalog.db"))
+        self.library = open_library(self.settings)
+        self.systems, self._files, self._index, self.dats, self.changes, self.saved = {}, None, None, None, {}, None
+        self._migrate_packages_json()
         self._ensure_systems_json()
 
+    @property
+    def files(self):  # Whole catalog, mapped from packages.bin on first use
+        if self._files is None: self._files = self.catalog.view()
+        return self._files
+
+    @files.setter
+    def files(self, value): self._files = value
+
+    @property
+    def index(self):  # Name index for repeated searches in long-running processes, built once per catalog snapshot
+        if self._index is None: self._index = self.catalog.index(self.files)
+        return self._index
+
+    def query(self, terms): return Query(terms, self.systems)  # Compile search terms against the configured systems
+
+    def find(self, terms): return self.catalog.search(self.query(terms))  # Catalog packages matching search terms
+
+    def plan(self, pkgs):  # 1G1R: keep the best variant of each title for preferred_regions, remembering what the others would have cost
+        keep, skipped = RomCleaner(",".join(self.settings["preferred_regions"])).plan(pkgs)
+        self.saved = (len(skipped), sum(f.get("size_bytes", 0) for f in skipped if not self.library.installed(f)))
+        return keep
+
     def _ensure_systems_json(self):  # Ensure systems.json exists in config dir
         if os.path.exists(self.cfg): return
         # Find systems.json relative to package directory
@@ -97,117 +1128,144 @@ class Manager:  # Main package manager class
         if os.path.exists(source):
             shutil.copy(source, self.cfg)
 
+    def _migrate_packages_json(self):  # Import the catalog of older versions, which kept it in packages.json and listing validators in listings.json
+        legacy, lst = os.path.join(self.config_dir, "packages.json"), os.path.join(self.config_dir, "listings.json")
+        if not os.path.exists(legacy): return
+        if not self.catalog.count():
+            try: listings = json.load(open(lst))
+            except (OSError, ValueError): listings = {}
+            by_system = {}
+            for f in json.load(open(legacy)): by_system.setdefault(f["system"], []).append(f)
+            for sys_name, files in by_system.items(): self.catalog.store(sys_name, files, listings)  # The next update stays conditional
+            self.catalog.export()
+        os.remove(legacy)  # Only once the catalog holds both
+        if os.path.exists(lst): os.remove(lst)
+
     def load(self):  # Load systems configuration
         try: self.systems = json.load(open(self.cfg)); return True
         except: return False
 
-    def fetch_system(self, sys_name):  # Fetch games for specific system
-        out, fmt = [], [e.lower() for e in self.systems[sys_name].get("format", [])]
+    def load_dats(self):  # Load imported DAT checksums, keyed by system then ROM name
+        if self.dats is None:
+            try: self.dats = json.load(open(os.path.join(self.config_dir, "dats.json")))
+            except: self.dats = {}
+        return self.dats
+
+    def import_dat(self, sys_name, path):  # Import CRC32/MD5/SHA1 per ROM from a No-Intro/Redump DAT file
+        roms = {}
+        for _, el in ElementTree.iterparse(path):
+            if el.tag == "rom" and el.get("name"):
+                roms[os.path.basename(el.get("name"))] = {k: (el.get(k) or "").lower() for k in ("crc", "md5", "sha1") if el.get(k)}
+                roms[os.path.basename(el.get("name"))]["size"] = int(el.get("size") or 0)
+            if el.tag in ("game", "machine"): el.clear()
+        if not roms: raise Exception(f"No ROM entries in {path}")
+        algo = next(a for a in ("sha1", "md5", "crc") if all(a in r for r in roms.values()) or a == "crc")
+        dats = self.load_dats()
+        dats[sys_name] = {"algo": algo, "roms": roms}
+        with open(os.path.join(self.config_dir, "dats.json"), "w") as f: json.dump(dats, f)
+        return len(roms)
+
+    def fetch_system(self, sys_name, known=None, listings=None):  # Fetch games for specific system
+        # known holds the previous catalog by listing URL, which is reused when the server answers 304 Not Modified
+        out, fmt, changed, fresh = [], [e.lower() for e in self.systems[sys_name].get("format", [])], known is None, {}
         for url in self.systems[sys_name].get("url", []):
-            lst = [f for f in get_directory_listing(url) if any(f["name"].lower().endswith("." + e) for e in fmt) or f["name"].lower().endswith((".zip", ".7z", ".tar.xz", ".rar"))]
+            cond = dict(listings.get(url, {})) if listings is not None and url in (known or {}) else {}
+            lst = get_directory_listing(url, self.session, cond)
+            if lst is None: out.extend(known[url]); continue
+            changed, fresh[url] = True, cond
+            lst = [f for f in lst if any(f["name"].lower().endswith("." + e) for e in fmt) or f["name"].lower().endswith((".zip", ".7z", ".tar.xz", ".rar"))]
             for f in lst: f["system"] = sys_name
             out.extend(lst)
-        return out
+        if listings is not None: listings.update(fresh)  # Only after every listing of the system succeeded
+        return out, changed
 
-    def fetch(self):  # Fetch all systems with progress bar
+    def fetch(self):  # Fetch all systems with progress bar, only re-parsing listings that changed upstream
         if not self.load(): return
         stats = {"pending": len(self.systems), "fetching": 0, "done": 0, "failed": 0}
         stats_lock = __import__('threading').Lock()
-        
+        listings = self.catalog.listings()
+        self.changes = {}  # {system: (added names, removed names)} for listings that changed
+
         def fetch_with_stats(sys_name):
             with stats_lock: stats["pending"] -= 1; stats["fetching"] += 1
-            try: result = self.fetch_system(sys_name)
-            except: result = []
+            before, known = self.catalog.system(sys_name), {}
+            for f in before: known.setdefault(f["base"], []).append(f)
+            try: result, changed = self.fetch_system(sys_name, known, listings)
+            except: result, changed = None, False
             with stats_lock: stats["fetching"] -= 1; stats["done"] += 1 if result else 0; stats["failed"] += 1 if not result else 0
-            return result
+            if result is None: result = before  # Keep the previous catalog of unreachable systems
+            elif changed:
+                old_names, new_names = {f["name"] for f in before}, {f["name"] for f in result}
+                self.changes[sys_name] = (sorted(new_names - old_names), sorted(old_names - new_names))
+            return sys_name, result, changed
         
+        stored = False
         with ThreadPoolExecutor(max_workers=self.settings["fetch_workers"]) as exe:
             futures = {exe.submit(fetch_with_stats, sys_name): sys_name for sys_name in self.systems}
-            self.files = []
             with tqdm(total=100, desc="Fetching", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
                 for fut in as_completed(futures):
-                    self.files.extend(fut.result())
+                    sys_name, result, changed = fut.result()
+                    if changed: self.catalog.store(sys_name, result, listings); stored = True
                     desc = f"\033[90m⋯{stats['pending']}\033[0m \033[36m↓{stats['fetching']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
                     pbar.set_description(desc)
                     progress = int(((stats['done'] + stats['failed']) / len(self.systems)) * 100)
                     pbar.n = progress; pbar.refresh()
         
-        json.dump(self.files, open(os.path.join(self.config_dir, "packages.json"), "w"))
+        if self.catalog.prune(self.systems) or stored or not os.path.exists(self.catalog.bin):
+            self._files = self._index = None  # Drop the old mappings before the snapshot is replaced
+            self.catalog.export()
 
     def update(self):  # Update package lists and show systems
         self.fetch()
         print("\033[1mListing systems...\033[0m")
         for sys_name in sorted(self.systems.keys()):
-            sys_files = [f for f in self.files if f["system"] == sys_name]
-            total_size = sum(f.get("size_bytes", 0) for f in sys_files)
+            sys_files = self.files.system(sys_name)
+            total_size = sys_files.total_size()
             count = len(sys_files)
             size_str = format_size(total_size)
             system_colored = f"\033[36m[{sys_name}]\033[0m"
+            added, removed = self.changes.get(sys_name, ((), ()))
+            diff = f" \033[92m+{len(added)}\033[0m \033[91m-{len(removed)}\033[0m" if added or removed else ""
             if count > 0:
-                print(f"\033[92m✓ {size_str} {system_colored} ({count})\033[0m")
+                print(f"\033[92m✓ {size_str} {system_colored} ({count})\033[0m{diff}")
             else:
                 print(f"\033[91m✗ {size_str} {system_colored} ({count})\033[0m")
 
-    def search(self, query_terms):  # Search available games
-        inc = [t.lower() for t in query_terms if t.lower() in [s.lower() for s in self.systems.keys()]]
-        kw = [t for t in query_terms if t.lower() not in [s.lower() for s in self.systems.keys()] and not t.startswith('-')]
-        exc = [t[1:] for t in query_terms if t.startswith('-')]
-        
-        if len(query_terms) == 2 and query_terms[0].lower() == "all" and query_terms[1].lower() in [s.lower() for s in self.systems.keys()]:
-            results = [f for f in self.files if f["system"].lower() == query_terms[1].lower()]
-        else: 
-            results = [f for f in self.files if (not inc or f["system"].lower() in inc) and (not kw or all(k.lower() in f["name"].lower() for k in kw)) and (not exc or not any(e.lower() in f["name"].lower() for e in exc))]
-        
-        if not results: print("No packages found."); return
+    def search(self, query_terms, limit=None, cursor=None):  # Search available games: per-system totals, then the best matches as they are ranked
+        query, view = self.query(query_terms), self.files
+        ids = query.ids(view)
         
-        by_system = {}
-        for f in results:
-            if f["system"] not in by_system: by_system[f["system"]] = []
-            by_system[f["system"]].append(f)
+        if not ids: print("No packages found."); return
         
-        for sys_name in sorted(by_system.keys()):
-            sys_files = by_system[sys_name]
-            total_size = sum(f.get("size_bytes", 0) for f in sys_files)
-            count = len(sys_files)
-            installed = 0
-            system_dir = os.path.join(self.settings["roms_dir"], sys_name)
-            if os.path.exists(system_dir):
-                for f in sys_files:
-                    bn = os.path.splitext(f["name"])[0]
-                    is_installed = any(os.path.splitext(x)[0] == bn for x in os.listdir(system_dir) if os.path.isfile(os.path.join(system_dir, x)))
-                    if is_installed: installed += 1
+        totals = view.totals(ids)
+        for sys_name in sorted(totals):
+            count, total_size = totals[sys_name]
+            bases, part = self.library.bases(sys_name), view.system(sys_name)
+            installed = sum(1 for i in ids[bisect.bisect_left(ids, part.lo):bisect.bisect_left(ids, part.hi)] if os.path.splitext(view.name(i))[0] in bases) if bases else 0
             
             size_str = format_size(total_size)
             system_colored = f"\033[36m[{sys_name}]\033[0m"
             print(f"{system_colored} {size_str} ({count})" + (f" ({installed} installed)" if installed > 0 else ""))
-            
-            for f in sys_files:
-                bn = os.path.splitext(f["name"])[0]
-                is_installed = False
-                if os.path.exists(system_dir):
-                    is_installed = any(os.path.splitext(x)[0] == bn for x in os.listdir(system_dir) if os.path.isfile(os.path.join(system_dir, x)))
-                status = " \033[92m[installed]\033[0m" if is_installed else ""
-                size_colored = f"\033[33m({format_size(f.get('size_bytes', 0))})\033[0m"
-                print(f"  {size_colored} {f['name']}{status}")
-            print()
+        print()
+        
+        limit = self.settings["search_limit"] if limit is None else limit
+        shown, last = 0, None
+        for key, f in query.ranked(view, ids, self.settings["preferred_regions"], Query.after(cursor) if cursor else None, limit + 1 if limit else None):
+            if limit and shown == limit:
+                print(f"\nShowing {shown} of {len(ids)}. Next page: retro search --limit {limit} --cursor {Query.cursor(last)} {' '.join(query_terms)}"); break
+            is_installed = os.path.splitext(f["name"])[0] in self.library.bases(f["system"])
+            status = " \033[92m[installed]\033[0m" if is_installed else ""
+            size_colored = f"\033[33m({format_size(f.get('size_bytes', 0))})\033[0m"
+            print(f"  \033[36m[{f['system']}]\033[0m {size_colored} {f['name']}{status}")
+            shown, last = shown + 1, key
 
-    def search_for_install(self, terms=None):  # Search and prepare for installation
+    def search_for_install(self, terms=None, one_game_one_rom=None, chd=None):  # Search and prepare for installation
         if terms is None: terms = input("Keywords: ").split()
-        inc = [t.lower() for t in terms if t.lower() in [s.lower() for s in self.systems.keys()]]
-        kw = [t for t in terms if t.lower() not in [s.lower() for s in self.systems.keys()] and not t.startswith('-')]
-        exc = [t[1:] for t in terms if t.startswith('-')]
-        
-        if len(terms) == 2 and terms[0].lower() == "all" and terms[1].lower() in [s.lower() for s in self.systems.keys()]:
-            out = [p for p in self.files if p["system"].lower() == terms[1].lower()]
-        else:
-            out = []
-            for p in self.files:
-                system_match = not inc or p["system"].lower() in inc
-                name_match = not kw or all(k.lower() in p["name"].lower() for k in kw)
-                exclude_match = not exc or not any(e.lower() in p["name"].lower() for e in exc)
-                if system_match and name_match and exclude_match: out.append(p)
+        out = self.find(terms)
         
         if not out: print("No packages found."); return None
+        if self.settings["one_game_one_rom"] if one_game_one_rom is None else one_game_one_rom: out = self.plan(out)  # Regional variants are dropped before anything is downloaded
+        else: self.saved = None
         
         by_system = {}
         for f in out:
@@ -224,16 +1282,7 @@ class Manager:  # Main package manager class
             
             for f in sys_files:
                 # Check if game is already installed
-                bn = os.path.splitext(f["name"])[0]
-                system_dir = os.path.join(self.settings["roms_dir"], sys_name)
-                is_installed = False
-                if os.path.exists(system_dir):
-                    for existing_file in os.listdir(system_dir):
-                        if os.path.isfile(os.path.join(system_dir, existing_file)):
-                            existing_bn = os.path.splitext(existing_file)[0]
-                            if existing_bn == bn:
-                                is_installed = True
-                                break
+                is_installed = self.library.installed(f)
                 
                 size_colored = f"\033[33m({format_size(f.get('size_bytes', 0))})\033[0m"
                 status = " \033[92m[installed]\033[0m" if is_installed else ""
@@ -241,106 +1290,288 @@ class Manager:  # Main package manager class
             print()
         
         # Calculate total size only for packages that are not already installed
-        new_packages = []
-        for f in out:
-            bn = os.path.splitext(f["name"])[0]
-            system_dir = os.path.join(self.settings["roms_dir"], f["system"])
-            is_installed = False
-            if os.path.exists(system_dir):
-                for existing_file in os.listdir(system_dir):
-                    if os.path.isfile(os.path.join(system_dir, existing_file)):
-                        existing_bn = os.path.splitext(existing_file)[0]
-                        if existing_bn == bn:
-                            is_installed = True
-                            break
-            if not is_installed:
-                new_packages.append(f)
+        new_packages = [f for f in out if not self.library.installed(f)]
         
         total_size = sum(f.get("size_bytes", 0) for f in new_packages)
         print(f"Total: {format_size(total_size)} ({len(new_packages)} packages)" + (f" ({len(out) - len(new_packages)} installed)" if len(out) > len(new_packages) else ""))
+        if self.saved and self.saved[0]: print(f"1G1R: {self.saved[0]} variants skipped, {format_size(self.saved[1])} saved")
+        if self.settings["disk_check"] and new_packages:
+            chd = self.settings["install_chd"] if chd is None else chd
+            fits, rest, free = self.preflight(new_packages, chd)
+            print(f"Disk: about {format_size(sum(self.footprint(f, chd)[1] for f in new_packages))} needed" + (" as CHD" if chd else "") + f", {format_size(free)} free")
+            if rest: print(f"\033[93mW: only {len(fits)} of {len(new_packages)} packages fit, {len(rest)} ({format_size(sum(f.get('size_bytes', 0) for f in rest))}) will be skipped for lack of space\033[0m")
         return out
 
-    def install(self, pkgs):  # Install packages with progress bar
-        from threading import Lock
-        stats = {"pending": len(pkgs), "downloading": 0, "extracting": 0, "done": 0, "failed": 0}
-        stats_lock = Lock()
-        
-        def worker(f):
-            dest, tmp = os.path.join(self.settings["roms_dir"], f["system"]), os.path.join(self.settings["roms_dir"], f["system"], "tmp")
-            os.makedirs(dest, exist_ok=True); os.makedirs(tmp, exist_ok=True)
-            
-            # Check if exact file already exists
-            if os.path.exists(os.path.join(dest, f["name"])): 
-                with stats_lock: stats["pending"] -= 1; stats["done"] += 1
-                return ("skipped", f)
-                
-            # Check if game with same base name already exists (without extension)
-            bn = os.path.splitext(f["name"])[0]
-            if os.path.exists(dest):
-                for existing_file in os.listdir(dest):
-                    if os.path.isfile(os.path.join(dest, existing_file)):
-                        existing_bn = os.path.splitext(existing_file)[0]
-                        if existing_bn == bn:
-                            with stats_lock: stats["pending"] -= 1; stats["done"] += 1
-                            return ("skipped", f)
-            
-            tmp_path = os.path.join(tmp, f["name"])
-            url = f["base"].rstrip("/") + "/" + f["link"]
+    def footprint(self, f, chd=False):  # (peak, final) disk bytes a package is expected to take: archive plus extracted files, then what stays
+        size, ext = f.get("size_bytes", 0), package_ext(f["name"])
+        formats = [e.lower() for e in self.systems[f["system"]].get("format", [])]
+        if ext in formats: return size, size
+        out = int(size * self.settings["extract_ratio"].get(ext, 1))
+        discs = chd and any(e == "chd" or "." + e in DISC_MODES for e in formats)  # Systems keeping disc images end up with CHDs
+        return size + out, int(out * self.settings["chd_ratio"]) if discs else out
+
+    def preflight(self, pkgs, chd=False):  # Packages that fit the free space in the given order, the ones that do not, and the free bytes
+        budget = DiskBudget(self.settings["roms_dir"], self.settings["min_free_bytes"])
+        free, fits, rest = budget.free(), [], []
+        for f in pkgs:
+            peak, final = self.footprint(f, chd)
+            if peak <= free: free -= final; fits.append(f)
+            else: rest.append(f)
+        return fits, rest, budget.free()
+
+    def _package_job(self, f):  # Resolve destination, temp path and archive type for a package
+        dest = os.path.join(self.settings["roms_dir"], f["system"])
+        ext = package_ext(f["name"])
+        dat = self.load_dats().get(f["system"])
+        return {"pkg": f, "dest": dest, "tmp": os.path.join(dest, "tmp", f["name"]), "url": package_url(f),
+                "ext": ext, "is_rom": ext in [e.lower() for e in self.systems[f["system"]].get("format", [])],
+                "algos": (dat["algo"],) if dat else (), "digests": {}}
+
+    def _from_cache(self, job):  # Serve a package from the download cache, None on a miss
+        blob = self.cache.get(job["url"], job["pkg"].get("size_bytes", 0), self.session) if self.cache else None
+        if not blob: return None
+        if job["is_rom"]:
+            link_or_copy(blob, os.path.join(job["dest"], job["pkg"]["name"]))
+            job["digests"][job["pkg"]["name"]] = hash_file(blob, job["algos"]) if job["algos"] else {}
+            return False
+        job["tmp"], job["cached"] = blob, True  # Extract straight from the blob
+        return True
+
+    def _to_cache(self, job, meta):  # Keep a finished download in the cache
+        if self.cache: self.cache.put(job["url"], job["pkg"].get("size_bytes", 0), meta or {}, job["tmp"])
+
+    def _fetch_package(self, job):  # Download stage, returns True if the archive still needs extracting
+        os.makedirs(os.path.dirname(job["tmp"]), exist_ok=True)
+        cached = self._from_cache(job)
+        if cached is not None: return cached
+        threshold = self.settings["segment_threshold"]
+        # Small archives unpack straight from the network; big ones keep the resumable temp-file path
+        if not job["is_rom"] and self.settings["stream_extract"] and job["ext"] in STREAM_FORMATS and not os.path.exists(job["tmp"]) and (not threshold or job["pkg"].get("size_bytes", 0) < threshold):
+            tee = self.cache.writer(job["url"]) if self.cache else None
             try:
-                with stats_lock: stats["pending"] -= 1; stats["downloading"] += 1
-                download_file(url, tmp_path)
-                with stats_lock: stats["downloading"] -= 1; stats["extracting"] += 1
-                
-                ext = "tar.xz" if f["name"].endswith(".tar.xz") else os.path.splitext(f["name"])[1].lstrip(".").lower()
-                if ext in [e.lower() for e in self.systems[f["system"]].get("format", [])]:
-                    shutil.move(tmp_path, os.path.join(dest, f["name"]))
-                else: 
-                    extract_archive(tmp_path, dest, ext); os.remove(tmp_path)
-                
-                with stats_lock: stats["extracting"] -= 1; stats["done"] += 1
-                return ("done", f)
-            except Exception as e: 
-                with stats_lock: stats["downloading"] = max(0, stats["downloading"] - 1); stats["extracting"] = max(0, stats["extracting"] - 1); stats["failed"] += 1
-                return ("error", f, str(e))
-        
-        with tqdm(total=100, desc="Installing", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
-            with ThreadPoolExecutor(max_workers=self.settings["install_workers"]) as exe:
-                futures = {exe.submit(worker, pkg): pkg for pkg in pkgs}
-                results = []
-                for fut in as_completed(futures): 
-                    result = fut.result()
-                    results.append(result)
-                    desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m↓{stats['downloading']}\033[0m \033[36m⚙{stats['extracting']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
-                    pbar.set_description(desc)
-                    progress = int(((stats['done'] + stats['failed']) / len(pkgs)) * 100)
-                    pbar.n = progress; pbar.refresh()
+                job["digests"], meta = stream_extract(job["url"], job["dest"], job["ext"], self.session, tee, job["algos"], job.get("progress"))
+                if tee: tee.close(); self.cache.put(job["url"], job["pkg"].get("size_bytes", 0), meta, tee.name, move=True)
+                return False
+            except StreamUnsupported: pass
+            finally:
+                if tee and not tee.closed: tee.close(); os.remove(tee.name)
+        sink = HashSink(job["algos"]) if job["is_rom"] and job["algos"] else None
+        self._to_cache(job, download_file(job["url"], job["tmp"], threshold, self.settings["segment_workers"], self.session, sink, job.get("progress")))
+        return self._place_download(job, sink)
+
+    def _place_download(self, job, sink=None):  # Move a downloaded ROM into place, returns True for archives
+        if not job["is_rom"]: return True
+        # Segmented downloads arrive out of order and are hashed afterwards
+        job["digests"][job["pkg"]["name"]] = {} if not sink else sink.hexdigests() if sink.count == os.path.getsize(job["tmp"]) else hash_file(job["tmp"], job["algos"])
+        shutil.move(job["tmp"], os.path.join(job["dest"], job["pkg"]["name"]))
+        return False
+
+    async def _fetch_package_async(self, job, http):  # Download stage on the asyncio engine
+        os.makedirs(os.path.dirname(job["tmp"]), exist_ok=True)
+        cached = await asyncio.get_running_loop().run_in_executor(None, self._from_cache, job) if self.cache else None  # Revalidation is a blocking request
+        if cached is not None: return cached
+        pos, meta = os.path.getsize(job["tmp"]) if os.path.exists(job["tmp"]) else 0, {}
+        sink = HashSink(job["algos"]) if job["is_rom"] and job["algos"] else None
+        async with http.get(job["url"], headers={'Range': f'bytes={pos}-', 'Accept-Encoding': 'identity'}) as r:
+            if r.status != 416:
+                r.raise_for_status()
+                total, meta = response_total(r.status, r.headers, pos), validators(r.headers)
+                with open(job["tmp"], 'ab' if pos and r.status == 206 else 'wb') as f:
+                    async for c in r.content.iter_chunked(65536):
+                        f.write(c)
+                        if sink: sink.update(c)
+                        if job.get("progress"): job["progress"](len(c))
+                if os.path.getsize(job["tmp"]) < total: raise Exception(f"Incomplete download: {job['tmp']}")
+        self._to_cache(job, meta)
+        return self._place_download(job, sink)
+
+    def _extract_package(self, job, pool=None):  # Extraction stage, in a process pool when given
+        args = (job["tmp"], job["dest"], job["ext"], job["algos"])
+        job["digests"] = pool.submit(extract_archive, *args).result() if pool else extract_archive(*args)
+        if not job.get("cached"): os.remove(job["tmp"])
+
+    def _result(self, job):  # Result tuple for an installed package, checking written files against its DAT
+        dat, bad = self.load_dats().get(job["pkg"]["system"]), []
+        for name, digests in job["digests"].items():
+            expected = dat["roms"].get(os.path.basename(name), {}).get(dat["algo"]) if dat else None
+            if expected and digests.get(dat["algo"]) != expected: bad.append(f"{os.path.basename(name)} {dat['algo']} {digests.get(dat['algo'])} != {expected}")
+        return ("mismatch", job["pkg"], "; ".join(bad)) if bad else ("done", job["pkg"])
+
+    def install(self, pkgs, query=None, resume=None, chd=None, monitor=None):  # Install packages with progress bar, returns their results
+        # chd (default install_chd) compresses disc images to CHD as they land; an InstallMonitor follows or cancels the install from another thread
+        # Downloads run in an I/O thread pool and hand archives through a bounded queue to a process pool,
+        # so GIL-heavy 7z/xz decompression runs on every core while the network stays busy
+        stats = {"pending": len(pkgs), "downloading": 0, "extracting": 0, "done": 0, "failed": 0, "bytes": 0}
+        stats_lock, cancel = threading.Lock(), monitor.cancel if monitor else threading.Event()
+        if monitor: monitor.stats = stats
+        extract_workers = self.settings["extract_workers"] or os.cpu_count() or 1
+        staged, finished = queue.Queue(maxsize=extract_workers * 2), queue.Queue()
+        journal, states, chd = self.journal, {}, self.settings["install_chd"] if chd is None else chd
+        if journal: job_id, states = resume or (journal.start(query or "", pkgs, {"chd": chd}), {})  # Resumed with the same options
+        # Installed base names scanned once up front, the directories keep changing while packages land
+        present = {sys_name: self.library.bases(sys_name) for sys_name in {f["system"] for f in pkgs}}
+        # Extracted disc images go straight to chdman, overlapping the remaining downloads; at most chd_buffer bytes
+        # of raw images wait at once, beyond that extraction and, through the staging queue, downloads pause
+        converter = Converter() if chd else None
+        # Packages reserve their expected peak disk use before downloading and wait while it does not fit;
+        # the ones that fit the free space go first so a full disk stops the install at the packages left over
+        budget, reserved = DiskBudget(self.settings["roms_dir"], self.settings["min_free_bytes"]) if self.settings["disk_check"] else None, {}
+        if budget: pkgs = sum(self.preflight(pkgs, chd)[:2], [])
+        if converter:
+            converted, files_lock = queue.Queue(), threading.Lock()
+            def chd_done(conv, ok):  # Journal the CHD in place of the image it replaced
+                if ok and journal:
+                    with files_lock:
+                        conv["files"][conv["files"].index(conv["src"])] = conv["out"]
+                        journal.installed(conv["url"], [p for p in conv["files"] if os.path.exists(p)])
+                converted.put(ok)
+            conversions = converter.queue(self.settings["compress_workers"], chd_done, self.settings["chd_buffer"], budget)
+
+        def finish(result, stage, job=None):  # Record a package leaving the given stage
+            files, url = [os.path.join(job["dest"], n) for n in job["digests"]] if job else [], job["url"] if job else package_url(result[1])
+            if budget and url in reserved: budget.release(reserved.pop(url))
+            if journal:
+                if result[0] == "error": journal.mark(job_id, url, "failed", error=result[2])
+                else:
+                    if job: journal.installed(url, files)
+                    journal.mark(job_id, url, "done")
+            if converter and job and result[0] == "done":
+                discs = converter.disc_jobs(job["dest"], list(job["digests"]))
+                for conv in discs: conv.update(url=job["url"], files=files)
+                if discs: conversions.put(*discs)
+            with stats_lock:
+                if stage: stats[stage] -= 1
+                stats["done" if result[0] in ("done", "skipped") else "failed"] += 1
+            finished.put(result)
+
+        def prepare(f):  # Skip check and job setup shared by both engines, None when already installed
+            with stats_lock: stats["pending"] -= 1; stats["downloading"] += 1
+            if cancel.is_set(): finish(("error", f, "cancelled"), "downloading"); return None
+            if (journal and journal.is_installed(package_url(f), os.path.join(self.settings["roms_dir"], f["system"]))) or os.path.splitext(f["name"])[0] in present[f["system"]]: finish(("skipped", f), "downloading"); return None
+            job, seen = self._package_job(f), [0, 0]
+            def progress(n):  # Count downloaded bytes, journal byte offsets of the running download every few MB, stop it once cancelled
+                with stats_lock: stats["bytes"] += n
+                if cancel.is_set(): raise InstallCancelled("cancelled")
+                seen[0] += n
+                if journal and seen[0] - seen[1] >= 8 * 1024**2: seen[1] = seen[0]; journal.mark(job_id, job["url"], "queued", offset=seen[0])
+            job["progress"] = progress
+            # Archives downloaded before an interruption go straight back to extraction
+            job["downloaded"] = states.get(job["url"]) == "downloaded" and not job["is_rom"] and os.path.exists(job["tmp"]) and not os.path.exists(job["tmp"] + ".parts")
+            return job
+
+        def admit(job, block=True):  # Reserve the package's expected peak disk use: True, False when it cannot fit, None while it does not fit yet
+            if not budget: return True
+            need = self.footprint(job["pkg"], chd)[0]
+            ok = budget.acquire(need, block)
+            if ok: reserved[job["url"]] = need
+            return ok
+
+        def fetched(job, needs_extract):  # Finish a package or move it to the extraction stage, True if it must be queued
+            if not needs_extract: finish(self._result(job), "downloading", job); return False
+            if journal: journal.mark(job_id, job["url"], "downloaded", offset=os.path.getsize(job["tmp"]))
+            with stats_lock: stats["downloading"] -= 1; stats["extracting"] += 1
+            return True
+
+        def download_worker(f):
+            try:
+                job = prepare(f)
+                if not job: return
+                if not admit(job): return finish(("error", f, "not enough disk space"), "downloading")
+                if not fetched(job, job["downloaded"] or self._fetch_package(job)): return
+            except Exception as e: return finish(("error", f, str(e)), "downloading")
+            staged.put(job)  # Blocks while the extraction stage is saturated
+
+        def extract_worker(pool):
+            while True:
+                job = staged.get()
+                if job is None: return
+                try:
+                    if cancel.is_set(): raise InstallCancelled("cancelled")  # The archive stays in <system>/tmp for --resume
+                    self._extract_package(job, pool)
+                    if journal: journal.mark(job_id, job["url"], "extracted")
+                    finish(self._result(job), "extracting", job)
+                except Exception as e: finish(("error", job["pkg"], str(e)), "extracting", job)
+
+        async def download_all():  # Asyncio engine, one event loop multiplexes every transfer
+            loop, sem, threshold = asyncio.get_running_loop(), asyncio.Semaphore(self.settings["async_concurrency"]), self.settings["segment_threshold"]
+            connector = aiohttp.TCPConnector(limit=self.settings["async_concurrency"])
+            async with aiohttp.ClientSession(connector=connector, headers={"User-Agent": "Mozilla/5.0"}, timeout=aiohttp.ClientTimeout(total=None, sock_read=60)) as http:
+                async def download_one(f):
+                    async with sem:
+                        try:
+                            job = await loop.run_in_executor(None, prepare, f)
+                            if not job: return
+                            ok = admit(job, block=False)
+                            while ok is None: await asyncio.sleep(1); ok = admit(job, block=False)
+                            if not ok: return finish(("error", f, "not enough disk space"), "downloading")
+                            # Segmented downloads of big files stay on the threaded path
+                            big = threshold and f.get("size_bytes", 0) >= threshold
+                            needs_extract = job["downloaded"] or await (loop.run_in_executor(None, self._fetch_package, job) if big else self._fetch_package_async(job, http))
+                            # Off the event loop, finishing a package may wait for room in the CHD conversion queue
+                            if not await loop.run_in_executor(None, fetched, job, needs_extract): return
+                        except Exception as e: return finish(("error", f, str(e)), "downloading")
+                    await loop.run_in_executor(None, staged.put, job)
+                await asyncio.gather(*(download_one(f) for f in pkgs))
+
+        use_async = self.settings["install_engine"] == "async"
+        if use_async and aiohttp is None:
+            print("W: aiohttp is not installed, using the threaded install engine"); use_async = False
+
+        results = []
+        with tqdm(total=100, desc="Installing", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar, \
+             ProcessPoolExecutor(max_workers=extract_workers, mp_context=multiprocessing.get_context("spawn")) as pool, \
+             ThreadPoolExecutor(max_workers=extract_workers) as extractors, \
+             ThreadPoolExecutor(max_workers=1 if use_async else self.settings["install_workers"]) as downloaders:
+            for _ in range(extract_workers): extractors.submit(extract_worker, pool)
+            if use_async: downloaders.submit(asyncio.run, download_all())
+            else:
+                for pkg in pkgs: downloaders.submit(download_worker, pkg)
+            for _ in pkgs:
+                results.append(finished.get())
+                desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m↓{stats['downloading']}\033[0m \033[36m⚙{stats['extracting']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
+                if converter: desc += f" \033[35m◆{conversions.stats['pending'] + conversions.stats['converting']}\033[0m"
+                pbar.set_description(desc)
+                progress = int(((stats['done'] + stats['failed']) / len(pkgs)) * 100)
+                pbar.n = progress; pbar.refresh()
+            for _ in range(extract_workers): staged.put(None)
+        if converter and cancel.is_set(): conversions.drop()  # Raw images that were not converted yet stay as they are
+        chd_stats = converter.wait(conversions, converted, "CHD") if converter else None
         
+        if journal: journal.finish(job_id)
         for sys_name in set(pkg["system"] for pkg in pkgs):
             tmp_dir = os.path.join(self.settings["roms_dir"], sys_name, "tmp")
+            if journal and os.path.exists(tmp_dir):  # Keep only leftovers that an unfinished package can resume from
+                keep = journal.pending_names(sys_name)
+                for name in os.listdir(tmp_dir):
+                    if name not in keep and name[:-len(".parts")] not in keep and os.path.isfile(os.path.join(tmp_dir, name)): os.remove(os.path.join(tmp_dir, name))
             if os.path.exists(tmp_dir) and not os.listdir(tmp_dir): shutil.rmtree(tmp_dir)
         
         # Count different types of results
         installed_count = sum(1 for r in results if r[0] == "done")
         skipped_count = sum(1 for r in results if r[0] == "skipped")
-        failed_count = sum(1 for r in results if r[0] == "error")
+        failed_count = sum(1 for r in results if r[0] in ("error", "mismatch"))  # Mismatches are listed below, as the progress bar counted them
         
         if skipped_count > 0:
             print(f"\033[92m✓ {installed_count}\033[0m installed, \033[93m⏭ {skipped_count}\033[0m skipped (installed), \033[91m✗ {failed_count}\033[0m failed")
         else:
             print(f"\033[92m✓ {installed_count}\033[0m installed, \033[91m✗ {failed_count}\033[0m failed")
+        if self.saved and self.saved[0]: print(f"\033[94m1G1R\033[0m {self.saved[0]} variants not downloaded, {format_size(self.saved[1])} saved")
+        no_space = [r[1] for r in results if r[0] == "error" and r[2] == "not enough disk space"]
+        if no_space: print(f"\033[93mW: {len(no_space)} packages ({format_size(sum(f.get('size_bytes', 0) for f in no_space))}) did not fit on disk, free some space and run 'retro install --resume'\033[0m")
+        if chd_stats and chd_stats["done"] + chd_stats["failed"]: print(f"\033[35mCHD\033[0m \033[92m✓ {chd_stats['done']}\033[0m disc images compressed, \033[91m✗ {chd_stats['failed']}\033[0m failed" + (" (raw images kept)" if chd_stats["failed"] else ""))
+        
+        mismatched = [r for r in results if r[0] == "mismatch"]
+        if mismatched:
+            print(f"\033[91m✗ {len(mismatched)}\033[0m failed DAT checksum verification:")
+            for _, f, detail in mismatched: print(f"  \033[36m[{f['system']}]\033[0m {f['name']}: {detail}")
+        return results
 
     def list(self):  # List installed games by system
         try: self.systems = json.load(open(self.cfg))
         except Exception as e: print(f"E: Error loading systems.json: {e}"); return
         
-        all_files = []
-        for sys_name in self.systems:
-            system_dir = os.path.join(self.settings["roms_dir"], sys_name)
-            if not os.path.exists(system_dir): continue
-            for file in os.listdir(system_dir):
-                file_path = os.path.join(system_dir, file)
-                if os.path.isfile(file_path) and not file.startswith('.'):
-                    all_files.append({"name": file, "path": file_path, "system": sys_name})
+        all_files = [{"name": file, "path": os.path.join(self.settings["roms_dir"], sys_name, file), "system": sys_name, "size": v[0]}
+                     for sys_name in self.systems for file, v in self.library.files(sys_name).items()]
         
         if not all_files: print("No games installed."); return
         
@@ -351,14 +1582,14 @@ class Manager:  # Main package manager class
         
         for sys_name in sorted(by_system.keys()):
             sys_files = by_system[sys_name]
-            total_size = sum(os.path.getsize(f['path']) for f in sys_files)
+            total_size = sum(f['size'] for f in sys_files)
             count = len(sys_files)
             size_str = format_size(total_size)
             system_colored = f"\033[36m[{sys_name}]\033[0m"
             print(f"{system_colored} {size_str} ({count})")
             
             for f in sys_files:
-                size_colored = f"\033[33m({format_size(os.path.getsize(f['path']))})\033[0m"
+                size_colored = f"\033[33m({format_size(f['size'])})\033[0m"
                 print(f"  {size_colored} {f['name']}")
             print()
 
@@ -367,30 +1598,13 @@ class Manager:  # Main package manager class
         try: self.systems = json.load(open(self.cfg))
         except Exception as e: print(f"E: Error loading systems.json: {e}"); return
         
-        all_files = []
-        for sys_name in self.systems:
-            system_dir = os.path.join(self.settings["roms_dir"], sys_name)
-            if not os.path.exists(system_dir): continue
-            for file in os.listdir(system_dir):
-                file_path = os.path.join(system_dir, file)
-                if os.path.isfile(file_path) and not file.startswith('.'):
-                    all_files.append({"name": file, "path": file_path, "system": sys_name})
-        
-        if not all_files: print("No games installed."); return
+        query, installed, out = self.query(terms), False, []
+        for sys_name in query.systems or self.systems:  # Only the directories of included systems are listed
+            for file, v in self.library.files(sys_name).items():
+                installed = True
+                if query.match(file): out.append({"name": file, "path": os.path.join(self.settings["roms_dir"], sys_name, file), "system": sys_name, "size": v[0]})
         
-        inc = [t.lower() for t in terms if t.lower() in [s.lower() for s in self.systems.keys()]]
-        kw = [t for t in terms if t.lower() not in [s.lower() for s in self.systems.keys()] and not t.startswith('-')]
-        exc = [t[1:] for t in terms if t.startswith('-')]
-        
-        if len(terms) == 2 and terms[0].lower() == "all" and terms[1].lower() in [s.lower() for s in self.systems.keys()]:
-            out = [p for p in all_files if p["system"].lower() == terms[1].lower()]
-        else:
-            out = []
-            for p in all_files:
-                system_match = not inc or p["system"].lower() in inc
-                name_match = not kw or all(k.lower() in p["name"].lower() for k in kw)
-                exclude_match = not exc or not any(e.lower() in p["name"].lower() for e in exc)
-                if system_match and name_match and exclude_match: out.append(p)
+        if not installed and not query.systems: print("No games installed."); return
         
         if not out: print("No games found to remove."); return
         
@@ -401,18 +1615,18 @@ class Manager:  # Main package manager class
         
         for sys_name in sorted(by_system.keys()):
             sys_files = by_system[sys_name]
-            total_size = sum(os.path.getsize(f['path']) for f in sys_files)
+            total_size = sum(f['size'] for f in sys_files)
             count = len(sys_files)
             size_str = format_size(total_size)
             system_colored = f"\033[36m[{sys_name}]\033[0m"
             print(f"{system_colored} {size_str} ({count})")
             
             for f in sys_files:
-                size_colored = f"\033[33m({format_size(os.path.getsize(f['path']))})\033[0m"
+                size_colored = f"\033[33m({format_size(f['size'])})\033[0m"
                 print(f"  {size_colored} {f['name']}")
             print()
         
-        total_size = sum(os.path.getsize(f['path']) for f in out)
+        total_size = sum(f['size'] for f in out)
         print(f"Total: {format_size(total_size)} ({len(out)} games)")
         
         confirm = input("Do you want to continue? [Y/n] ")
@@ -421,208 +1635,329 @@ class Manager:  # Main package manager class
             print(f"\033[92m✓ {len(out)}\033[0m games removed")
         else: print("Abort.")
 
+DISC_MODES = {".iso": "iso_to_chd", ".cue": "cue_to_chd", ".gdi": "gdi_to_chd"}  # Disc image extensions chdman can compress
+
+def cpu_cores():  # CPU cores this process may run on
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+class DiskBudget:  # Free space admission on the filesystem of path: jobs reserve their expected peak use and wait while it does not fit
+    def __init__(self, path, keep=0):
+        self.path, self.keep, self.held, self.cond = path, keep, 0, threading.Condition()
+
+    def free(self):  # Bytes available to new jobs: free space less the space kept free and what running jobs reserved
+        path = self.path
+        while not os.path.exists(path) and os.path.dirname(path) != path: path = os.path.dirname(path)
+        return shutil.disk_usage(path).free - self.keep - self.held
+
+    def acquire(self, need, block=True):  # Reserve need bytes: True once they fit, False if they cannot fit with nothing else reserved, None instead of waiting when not blocking
+        with self.cond:
+            while need > self.free():
+                if not self.held: return False
+                if not block: return None
+                self.cond.wait(5)  # Re-checked on every release and now and then, space can also be freed outside retro
+            self.held += need
+            return True
+
+    def release(self, need):
+        with self.cond: self.held -= need; self.cond.notify_all()
+
+class ConversionQueue:  # chdman scheduler: largest jobs first, up to `workers` processes sharing `cores` through their -np threads
+    def __init__(self, converter, workers=0, cores=0, on_done=None, max_bytes=0, budget=None):
+        self.converter, self.on_done, self.max_bytes, self.budget = converter, on_done, max_bytes, budget
+        self.cores = cores or cpu_cores()
+        self.workers = workers or self.cores
+        self.heap, self.seq, self.running, self.busy, self.bytes, self.closed, self.threads = [], 0, 0, 0, 0, False, []
+        self.stats = {"pending": 0, "converting": 0, "done": 0, "failed": 0}
+        self.cond = threading.Condition()
+
+    def put(self, *jobs):  # Queue job dicts, starting workers up to the limit, blocks while max_bytes of input are already queued or converting
+        with self.cond:
+            size = sum(job["size"] for job in jobs)
+            while self.max_bytes and self.bytes and self.bytes + size > self.max_bytes: self.cond.wait()
+            for job in jobs:
+                heapq.heappush(self.heap, (-job["size"], self.seq, job)); self.seq += 1
+                self.stats["pending"] += 1; self.bytes += job["size"]
+            while len(self.threads) < min(self.workers, self.seq):
+                t = threading.Thread(target=self._worker, daemon=True); t.start(); self.threads.append(t)
+            self.cond.notify_all()
+
+    def drop(self):  # Fail every job that has not started yet
+        with self.cond:
+            jobs = [e[2] for e in self.heap]; self.heap.clear()
+            self.bytes -= sum(job["size"] for job in jobs); self.stats["pending"] -= len(jobs); self.stats["failed"] += len(jobs)
+            self.cond.notify_all()
+        if self.on_done:
+            for job in jobs: self.on_done(job, False)
+
+    def close(self):  # No more jobs, workers exit once the queue drains
+        with self.cond: self.closed = True; self.cond.notify_all()
+
+    def join(self):
+        self.close()
+        for t in list(self.threads): t.join()
+
+    def _threads(self, job):  # -np of a job about to start: an even split of the cores between the jobs in flight, more for jobs holding a larger share of the bytes left, never more than the free cores
+        inflight = min(self.workers, self.running + len(self.heap) + 1)
+        share = max(self.cores // inflight, -(-self.cores * job["size"] // max(self.bytes, 1)))
+        return max(1, min(share, self.cores - self.busy))
+
+    def _admit(self):  # Largest queued job whose output fits the disk budget and its reservation (None if it can never fit), or no job while none fits yet
+        if not self.budget: return heapq.heappop(self.heap)[2], 0
+        hopeless = None
+        for entry in sorted(self.heap):
+            need = self.converter.output_size(entry[2])
+            ok = self.budget.acquire(need, block=False)
+            if ok: break
+            if ok is False and not hopeless: hopeless = entry  # Unless a smaller job frees space first
+        else:
+            if not hopeless: return None, 0
+            entry, need = hopeless, None
+        self.heap.remove(entry); heapq.heapify(self.heap)
+        return entry[2], need
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while True:
+                    while (not self.heap and not self.closed) or (self.heap and self.busy >= self.cores): self.cond.wait()
+                    if not self.heap: return
+                    job, need = self._admit()
+                    if job: break
+                    self.cond.wait(5)  # Out of space until running conversions delete their inputs
+                threads = self._threads(job) if need is not None else 0
+                self.running += 1; self.busy += threads; self.stats["pending"] -= 1; self.stats["converting"] += 1
+            if need is None: print(f"Error: not enough disk space to convert {os.path.basename(job['src'])}"); ok = False
+            else:
+                try: ok = self.converter._convert(job, threads)
+                except Exception: ok = False
+                if self.budget: self.budget.release(need)
+            with self.cond:
+                self.running -= 1; self.busy -= threads; self.bytes -= job["size"]
+                self.stats["converting"] -= 1; self.stats["done" if ok else "failed"] += 1
+                self.cond.notify_all()
+            if self.on_done: self.on_done(job, ok)
+
 class Converter:  # CHD conversion utilities
     def __init__(self, mode="chd_to_iso"): 
         self.mode = mode
         self.settings = load_settings()
 
+    def job(self, mode, path, extra=(), size=None):  # Conversion job carrying its own mode, input, output and companion files deleted with the input
+        path = os.path.abspath(os.path.normpath(path))
+        ext_map = {"chd_to_iso": ".iso", "chd_to_cue": ".cue", "chd_to_gdi": ".gdi"}
+        out = os.path.splitext(path)[0] + (".chd" if "to_chd" in mode else ext_map.get(mode, ""))
+        extra = [os.path.join(os.path.dirname(path), e) for e in extra]
+        if size is None: size = sum(os.path.getsize(p) for p in [path, *extra] if os.path.exists(p))
+        return {"mode": mode, "src": path, "out": out, "extra": extra, "size": size}
+
+    def disc_jobs(self, dest, names):  # Conversion jobs for the disc images among files just written under dest, with the tracks of each cue sheet
+        jobs = []
+        for n in names:
+            mode = DISC_MODES.get(os.path.splitext(n)[1].lower())
+            if not mode: continue
+            folder, base = os.path.split(n)
+            extra = self._bins({os.path.basename(m) for m in names if os.path.dirname(m) == folder}, base[:-4]) if mode == "cue_to_chd" else []
+            jobs.append(self.job(mode, os.path.join(dest, n), extra))
+        return jobs
+
+    def queue(self, workers=0, on_done=None, max_bytes=0, budget=None): return ConversionQueue(self, workers, self.settings["convert_cores"], on_done, max_bytes, budget)
+
+    def budget(self, path): return DiskBudget(path, self.settings["min_free_bytes"]) if self.settings["disk_check"] else None  # Free space admission for outputs written under path
+
+    def output_size(self, job):  # Expected size of a job's output, chd_ratio of the input for CHDs
+        return int(job["size"] * (self.settings["chd_ratio"] if "to_chd" in job["mode"] else 1 / self.settings["chd_ratio"]))
+
+    def preflight(self, jobs, budget):  # Jobs that cannot fit even after every smaller conversion reclaimed its input
+        free, rest = budget.free(), sorted(jobs, key=self.output_size)
+        while rest and self.output_size(rest[0]) <= free:
+            job = rest.pop(0); free += job["size"] - self.output_size(job)
+        return rest
+
+    def run(self, jobs, workers=0, desc="Converting", budget=None):  # Convert jobs on a ConversionQueue with a progress bar, returns its stats
+        finished = queue.Queue()
+        conversions = self.queue(workers, lambda job, ok: finished.put(ok), budget=budget)
+        conversions.put(*jobs)
+        return self.wait(conversions, finished, desc)
+
+    def wait(self, conversions, finished, desc="Converting"):  # Close a queue whose on_done reports to `finished`, with a progress bar until every job ran, returns its stats
+        conversions.close()
+        stats, total = conversions.stats, conversions.seq
+        with tqdm(total=100, desc=desc, bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
+            for _ in range(total):
+                finished.get()
+                pbar.set_description(f"\033[90m⋯{stats['pending']}\033[0m \033[33m⚙{stats['converting']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m")
+                pbar.n = int(((stats['done'] + stats['failed']) / total) * 100); pbar.refresh()
+        conversions.join()
+        return stats
+
     def convert_all(self, folder="."):  # Convert all files in folder
-        files = []
+        jobs = []
         for ext, mode in [("*.iso", "iso_to_chd"), ("*.cue", "cue_to_chd"), ("*.gdi", "gdi_to_chd")]:
-            files.extend([(mode, f) for f in glob(os.path.join(folder, ext))])
+            jobs.extend([self.job(mode, f) for f in glob(os.path.join(folder, ext))])
         
-        if not files: print("No files to convert."); return
-        
-        stats = {"pending": len(files), "converting": 0, "done": 0, "failed": 0}
-        stats_lock = __import__('threading').Lock()
-        
-        def convert_worker(mode, file_path):
-            with stats_lock: stats["pending"] -= 1; stats["converting"] += 1
-            try:
-                self.mode = mode
-                if self._convert(file_path):
-                    with stats_lock: stats["converting"] -= 1; stats["done"] += 1
-                else:
-                    with stats_lock: stats["converting"] -= 1; stats["failed"] += 1
-            except:
-                with stats_lock: stats["converting"] -= 1; stats["failed"] += 1
-        
-        with tqdm(total=100, desc="Converting", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
-            with ThreadPoolExecutor(max_workers=self.settings["convert_workers"]) as exe:
-                futures = {exe.submit(convert_worker, mode, file_path): (mode, file_path) for mode, file_path in files}
-                for fut in as_completed(futures):
-                    desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m⚙{stats['converting']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
-                    pbar.set_description(desc)
-                    progress = int(((stats['done'] + stats['failed']) / len(files)) * 100)
-                    pbar.n = progress; pbar.refresh()
+        if not jobs: print("No files to convert."); return
         
+        stats = self.run(jobs, self.settings["convert_workers"], "Converting", self.budget(folder))
         print(f"\033[92m✓ {stats['done']}\033[0m converted, \033[91m✗ {stats['failed']}\033[0m failed")
 
-    def _convert(self, f):  # Convert single file using chdman
-        f = os.path.normpath(f)
-        b = os.path.splitext(f)[0]
-        ext_map = {"chd_to_iso": ".iso", "chd_to_cue": ".cue", "chd_to_gdi": ".gdi"}
-        out = b + (".chd" if "to_chd" in self.mode else ext_map.get(self.mode, ""))
+    def _convert(self, job, threads=0):  # Convert single job using chdman, -np threads when creating a CHD (0 = chdman's default of every core)
+        f_abs, out_abs = job["src"], job["out"]
+        if not os.path.exists(f_abs): print(f"Error: Input file not found: {f_abs}"); return False
         
-        if not os.path.exists(f): print(f"Error: Input file not found: {f}"); return False
-        
-        f_abs, out_abs = os.path.abspath(f), os.path.abspath(out)
-        cmd = ["chdman", "createcd" if "to_chd" in self.mode else "extractcd", "-i", f_abs, "-o", out_abs, "-f"]
+        create = "to_chd" in job["mode"]
+        args = ["createcd" if create else "extractcd", "-i", f_abs, "-o", out_abs, "-f"]
+        if create and threads: args += ["-np", str(threads)]
         
         try:
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False, cwd=os.path.dirname(f_abs) or '.')
-            if result.returncode != 0:
-                stderr = result.stderr.decode('utf-8', errors='ignore').strip()
-                if stderr: print(f"Error converting {os.path.basename(f)}: {stderr[:100]}")
+            ok, stderr = self.chdman(*args, cwd=os.path.dirname(f_abs) or '.')
+            if not ok:
+                if stderr: print(f"Error converting {os.path.basename(f_abs)}: {stderr[:100]}")
+                if os.path.exists(out_abs): os.remove(out_abs)
                 return False
             
             if os.path.exists(out_abs) and os.path.getsize(out_abs) > 0:
-                os.remove(f_abs); return True
+                for p in [f_abs, *job["extra"]]:
+                    if os.path.exists(p): os.remove(p)
+                return True
             return False
         except FileNotFoundError: print("Error: chdman not found. Please install MAME tools."); return False
         except Exception as e: print(f"Error: {e}"); return False
 
+    def chdman(self, *args, cwd=None):  # Run chdman, returns whether it succeeded and its error output; FileNotFoundError when it is not installed
+        result = subprocess.run([self.settings["chdman"], *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False, cwd=cwd)
+        return result.returncode == 0, result.stderr.decode('utf-8', errors='ignore').strip()
+
+    def verify_all(self, force=False, report=False):  # chdman verify every CHD in the library in parallel, files unchanged since their last check keep its result; True when all pass
+        library, results, todo, gone = open_library(self.settings), [], [], []
+        system_dirs = [x.name for x in os.scandir(self.settings["roms_dir"]) if x.is_dir()] if os.path.isdir(self.settings["roms_dir"]) else []
+        for system in sorted(system_dirs):
+            files, cached = library.files(system), library.checks(system)
+            gone.extend((system, n) for n in cached.keys() - files.keys())
+            for n in sorted(files):
+                if not n.lower().endswith(".chd"): continue
+                try: st = os.stat(os.path.join(self.settings["roms_dir"], system, n))  # The index misses a CHD rewritten in place
+                except OSError: continue
+                c, v = cached.get(n), (st.st_size, st.st_mtime_ns)
+                if c and c[:2] == v[:2] and not force: results.append({"system": system, "name": n, "size": v[0], "ok": bool(c[2]), "error": c[3], "cached": True})
+                else: todo.append((system, n, v))
+        
+        def check(item):  # One chdman verify process
+            system, n, v = item
+            ok, stderr = self.chdman("verify", "-i", os.path.join(self.settings["roms_dir"], system, n))
+            return item, ok, "" if ok else (stderr.splitlines() or ["chdman verify failed"])[-1][:200]
+        
+        rows = []
+        try:
+            with tqdm(total=len(todo), desc="Verifying", ncols=60, leave=False, disable=not todo) as pbar, \
+                 ThreadPoolExecutor(max_workers=self.settings["verify_workers"] or cpu_cores()) as exe:
+                for (system, n, v), ok, error in (f.result() for f in as_completed([exe.submit(check, item) for item in todo])):
+                    results.append({"system": system, "name": n, "size": v[0], "ok": ok, "error": error, "cached": False})
+                    rows.append((system, n, v[0], v[1], int(ok), error))
+                    if len(rows) >= 100: library.store_checks(rows); rows = []  # Long runs keep what they checked if interrupted
+                    pbar.update(1)
+        except FileNotFoundError: print("Error: chdman not found. Please install MAME tools.", file=sys.stderr); return False
+        finally: library.store_checks(rows, gone)
+        
+        results.sort(key=lambda r: (r["system"], r["name"]))
+        failed = [r for r in results if not r["ok"]]
+        if report:
+            print(json.dumps({"checked": len(todo), "cached": len(results) - len(todo), "ok": len(results) - len(failed), "failed": len(failed),
+                              "files": [dict(r, path=os.path.join(self.settings["roms_dir"], r["system"], r["name"])) for r in results]}, indent=2))
+            return not failed
+        if not results: print("No CHD files to verify."); return True
+        print(f"\033[92m✓ {len(results) - len(failed)}\033[0m ok, \033[91m✗ {len(failed)}\033[0m failed ({len(results) - len(todo)} unchanged since their last check)")
+        for r in failed: print(f"  \033[36m[{r['system']}]\033[0m {r['name']}: {r['error']}")
+        return not failed
+
+    def _bins(self, files, file_base):  # Track files of a cue sheet among the indexed names of its directory
+        return [file_base + ".bin"] if file_base + ".bin" in files else [n for n in files if n.startswith(file_base) and n.endswith(".bin")]
+
     def auto_compress_all(self):  # Compress ROMs to CHD with preview
-        total_files = []
-        for system_dir in glob(os.path.join(self.settings["roms_dir"], "*")):
-            system = os.path.basename(system_dir)
-            for ext, mode in [("*.iso", "iso_to_chd"), ("*.cue", "cue_to_chd"), ("*.gdi", "gdi_to_chd")]:
-                total_files.extend([(mode, f, system) for f in glob(os.path.join(system_dir, ext))])
+        library, total_files = open_library(self.settings), []
+        system_dirs = [x.name for x in os.scandir(self.settings["roms_dir"]) if x.is_dir()] if os.path.isdir(self.settings["roms_dir"]) else []
+        for system in system_dirs:
+            files = library.files(system)
+            for ext, mode in [(".iso", "iso_to_chd"), (".cue", "cue_to_chd"), (".gdi", "gdi_to_chd")]:
+                for n, v in files.items():
+                    if not n.endswith(ext): continue
+                    bin_files = self._bins(files, n[:-4]) if mode == "cue_to_chd" else []
+                    size = v[0] + sum(files[b][0] for b in bin_files)
+                    total_files.append((system, bin_files, self.job(mode, os.path.join(self.settings["roms_dir"], system, n), bin_files, size)))
         
         if not total_files: print("No files to compress."); return
         
         print(f"The following files will be compressed:")
-        for mode, file_path, system in total_files:
+        for system, bin_files, job in total_files:
             system_colored = f"\033[36m[{system}]\033[0m"
-            size_colored = f"\033[33m({format_size(os.path.getsize(file_path))})\033[0m"
-            base_name = os.path.basename(file_path)
+            size_colored = f"\033[33m({format_size(job['size'])})\033[0m"
+            base_name = os.path.basename(job["src"])
             chd_name = os.path.splitext(base_name)[0] + ".chd"
             
             print(f"  {system_colored} {size_colored} {base_name}")
             print(f"    \033[92m→ Create:\033[0m {chd_name}")
             print(f"    \033[91m→ Delete:\033[0m {base_name}")
             
-            if mode == "cue_to_chd":
-                dir_name = os.path.dirname(file_path)
-                file_base = os.path.splitext(base_name)[0]
-                bin_files = glob(os.path.join(dir_name, f"{file_base}.bin")) or glob(os.path.join(dir_name, f"{file_base}*.bin"))
-                for bin_file in bin_files:
-                    print(f"    \033[91m→ Delete:\033[0m {os.path.basename(bin_file)}")
+            for bin_file in bin_files:
+                print(f"    \033[91m→ Delete:\033[0m {bin_file}")
+        
+        jobs, budget = [job for _, _, job in total_files], self.budget(self.settings["roms_dir"])
+        if budget:
+            total, out = sum(job["size"] for job in jobs), sum(self.output_size(job) for job in jobs)
+            print(f"Disk: {format_size(budget.free())} free, CHDs of about {format_size(out)} replace {format_size(total)}")
+            too_big = self.preflight(jobs, budget)
+            if too_big: print(f"\033[93mW: {len(too_big)} images ({format_size(sum(job['size'] for job in too_big))}) need more free space than there will be and are skipped\033[0m")
         
         confirm = input("Do you want to continue? [Y/n] ")
         if confirm.lower() not in ["y", "yes", ""]: print("Abort."); return
         
-        stats = {"pending": len(total_files), "compressing": 0, "done": 0, "failed": 0}
-        stats_lock = __import__('threading').Lock()
-        
-        def compress_worker(mode, file_path, system):
-            with stats_lock: stats["pending"] -= 1; stats["compressing"] += 1
-            try:
-                self.mode = mode
-                if self._convert(file_path):
-                    if mode == "cue_to_chd":
-                        dir_name = os.path.dirname(file_path)
-                        file_base = os.path.splitext(os.path.basename(file_path))[0]
-                        bin_files = glob(os.path.join(dir_name, f"{file_base}.bin")) or glob(os.path.join(dir_name, f"{file_base}*.bin"))
-                        for bin_file in bin_files: os.remove(bin_file)
-                    with stats_lock: stats["compressing"] -= 1; stats["done"] += 1
-                else:
-                    with stats_lock: stats["compressing"] -= 1; stats["failed"] += 1
-            except:
-                with stats_lock: stats["compressing"] -= 1; stats["failed"] += 1
-        
-        with tqdm(total=100, desc="Compressing", bar_format='{desc}: {percentage:3.0f}%', ncols=60, leave=False) as pbar:
-            with ThreadPoolExecutor(max_workers=self.settings["compress_workers"]) as exe:
-                futures = {exe.submit(compress_worker, mode, file_path, system): (mode, file_path, system) for mode, file_path, system in total_files}
-                for fut in as_completed(futures):
-                    desc = f"\033[90m⋯{stats['pending']}\033[0m \033[33m⚙{stats['compressing']}\033[0m \033[92m✓{stats['done']}\033[0m \033[91m✗{stats['failed']}\033[0m"
-                    pbar.set_description(desc)
-                    progress = int(((stats['done'] + stats['failed']) / len(total_files)) * 100)
-                    pbar.n = progress; pbar.refresh()
-        
+        stats = self.run(jobs, self.settings["compress_workers"], "Compressing", budget)
         print(f"\033[92m✓ {stats['done']}\033[0m compressed, \033[91m✗ {stats['failed']}\033[0m failed")
 
 class RomCleaner:  # Duplicate ROM detection and removal
-    def __init__(self, regions="W,E,U,J"): 
-        self.regions = regions.split(",")
+    def __init__(self, regions=None): 
         self.settings = load_settings()
+        self.regions = regions.split(",") if regions else list(self.settings["preferred_regions"])
+        self.rank_table, self.ranks = {r: i for i, r in enumerate(self.regions)}, {}
+
+    def _clean_name(self, filename): return parse_name(filename).clean  # Remove brackets/parentheses
 
-    def _build_rank_table(self, user_regions):  # Build region priority table
-        rank_table = {}
-        for i, region in enumerate(user_regions):
-            rank_table[region] = i
-        return rank_table
-
-    def _clean_name(self, filename): return re.sub(r'[\[\(].*?[\]\)]', '', filename).strip()  # Remove brackets/parentheses
-
-    def _extract_tags(self, filename): return re.findall(r'[\[\(]([^\]\)]+)[\]\)]', filename)  # Extract tags from filename
-
-    def _get_region(self, tags):  # Determine region from tags
-        for tag in tags:
-            if tag.upper() in ['W', 'E', 'U', 'J', 'USA', 'EUR', 'JPN', 'PAL', 'NTSC']:
-                return tag.upper()
-        return 'U'
-
-    def _region_rank(self, regions): return sum(self._build_rank_table(self.regions).get(r, 999) for r in regions)  # Calculate region priority
-
-    def _get_disc_info(self, tags):  # Extract disc/version info from tags
-        disc_info = {'disc': 1, 'version': 1, 'rev': 1}
-        for tag in tags:
-            if tag.lower().startswith('disc'): disc_info['disc'] = int(tag[4:]) if tag[4:].isdigit() else 1
-            elif tag.lower().startswith('v'): disc_info['version'] = int(tag[1:]) if tag[1:].isdigit() else 1
-            elif tag.lower().startswith('rev'): disc_info['rev'] = int(tag[3:]) if tag[3:].isdigit() else 1
-        return disc_info
-
-    def _build_rank(self, tags):  # Build ranking score for file selection
-        region = self._get_region(tags)
-        disc_info = self._get_disc_info(tags)
-        region_rank = self._region_rank([region])
-        purity_score = self._purity_score(tags, "")
-        return (region_rank, disc_info['disc'], disc_info['version'], disc_info['rev'], -purity_score)
-
-    def _purity_score(self, tags, filename):  # Calculate purity score for ROM quality
-        score = 0
-        for tag in tags:
-            tag_lower = tag.lower()
-            if tag_lower in ['w', 'e', 'u', 'j', 'usa', 'eur', 'jpn', 'pal', 'ntsc']: score += 10
-            elif tag_lower in ['final', 'complete', 'full']: score += 5
-            elif tag_lower in ['demo', 'beta', 'alpha', 'prototype']: score -= 20
-            elif tag_lower in ['hack', 'mod', 'patch']: score -= 10
-        return score
+    def rank(self, name):  # Ranking key of a file name, computed once per name: region priority, disc, latest version and revision, purity
+        key = self.ranks.get(name)
+        if key is None:
+            meta = parse_name(name)
+            # The preferred region of multi-region releases like (USA, Europe) counts, untagged names rank as USA
+            region = min((self.rank_table.get(r, 999) for r in meta.regions), default=self.rank_table.get('U', 999))
+            key = self.ranks[name] = (region, meta.disc, -meta.version, -meta.rev, -meta.purity)
+        return key
+
+    def _title_key(self, f):  # Files sharing a system, cleaned title and disc are variants of one game
+        meta = parse_name(f["name"])
+        return f["system"], meta.clean, meta.disc
+
+    def plan(self, files):  # 1G1R over package or file dicts: the best ranked variant of every title in input order, and the others
+        groups = {}
+        for f in files:
+            meta = parse_name(f["name"])
+            groups.setdefault((f["system"], meta.clean, meta.disc), []).append(f)
+        best = {id(g[0] if len(g) == 1 else min(g, key=lambda f: (self.rank(f["name"]), f["name"]))) for g in groups.values()}  # Lone titles need no ranking
+        return [f for f in files if id(f) in best], [f for f in files if id(f) not in best]
 
     def clean(self):  # Remove duplicate ROMs with preview
-        all_files = []
-        for system_dir in glob(os.path.join(self.settings["roms_dir"], "*")):
-            system = os.path.basename(system_dir)
-            for file in os.listdir(system_dir):
-                file_path = os.path.join(system_dir, file)
-                if os.path.isfile(file_path) and not file.startswith('.'):
-                    all_files.append((file_path, system))
+        library, all_files, sizes = open_library(self.settings), [], {}
+        system_dirs = [x.name for x in os.scandir(self.settings["roms_dir"]) if x.is_dir()] if os.path.isdir(self.settings["roms_dir"]) else []
+        for system in system_dirs:
+            for file, v in library.files(system).items():
+                file_path = os.path.join(self.settings["roms_dir"], system, file)
+                all_files.append({"name": file, "system": system, "path": file_path}); sizes[file_path] = v[0]
         
         if not all_files: print("No games found."); return
         
-        by_title = {}
-        for path, system in all_files:
-            filename = os.path.basename(path)
-            clean_title = self._clean_name(filename)
-            if clean_title not in by_title: by_title[clean_title] = []
-            by_title[clean_title].append((path, filename))
-        
-        duplicates = {title: files for title, files in by_title.items() if len(files) > 1}
-        if not duplicates: print("No duplicate games found."); return
-        
-        to_keep, to_delete = [], []
-        for title, files in duplicates.items():
-            ranked_files = []
-            for path, filename in files:
-                tags = self._extract_tags(filename)
-                rank = self._build_rank(tags)
-                ranked_files.append((rank, path, filename))
-            ranked_files.sort()
-            to_keep.append((ranked_files[0][1], title))
-            to_delete.extend([(path, title) for _, path, _ in ranked_files[1:]])
-        
-        if not to_delete: print("No duplicate games found."); return
+        keep, drop = self.plan(all_files)
+        if not drop: print("No duplicate games found."); return
+        
+        duplicated = {self._title_key(f) for f in drop}
+        to_keep = [(f["path"], self._clean_name(f["name"])) for f in keep if self._title_key(f) in duplicated]
+        to_delete = [(f["path"], self._clean_name(f["name"])) for f in drop]
         
         print(f"The following duplicate games will be processed:")
         
@@ -635,7 +1970,7 @@ class RomCleaner:  # Duplicate ROM detection and removal
             
             system = os.path.basename(os.path.dirname(path))
             system_colored = f"\033[36m[{system}]\033[0m"
-            size_colored = f"\033[33m({format_size(os.path.getsize(path))})\033[0m"
+            size_colored = f"\033[33m({format_size(sizes[path])})\033[0m"
             filename = os.path.basename(path)
             
             is_keep = (path, title) in to_keep
@@ -652,6 +1987,70 @@ class RomCleaner:  # Duplicate ROM detection and removal
             print(f"\033[92m✓ {len(to_delete)}\033[0m duplicates removed")
         else: print("Abort.")
 
+    def identical(self, library, link=False):  # Groups of byte-identical files, best ranked first: same size, then same first/last block, then same SHA-1
+        system_dirs = [x.name for x in os.scandir(self.settings["roms_dir"]) if x.is_dir()] if os.path.isdir(self.settings["roms_dir"]) else []
+        buckets = {}
+        for system in system_dirs:  # Sizes come from the index, no file is opened unless another one has the same size
+            for file, v in library.files(system).items():
+                if v[0]: buckets.setdefault((v[0],) if link else (system, v[0]), []).append({"name": file, "system": system, "size": v[0]})
+        groups = [g for g in buckets.values() if len(g) > 1]
+        # The index only notices a rewrite in place when the directory changes too, re-stat the candidates so their stored hashes are trusted only at (size, mtime)
+        library.restat([(f["system"], f["name"]) for g in groups for f in g])
+        files, buckets = {s: library.files(s) for s in {f["system"] for g in groups for f in g}}, {}
+        for f in (f for g in groups for f in g):
+            v = files[f["system"]].get(f["name"])
+            if v and v[0]: buckets.setdefault((v[0],) if link else (f["system"], v[0]), []).append(dict(f, size=v[0]))
+        groups = [g for g in buckets.values() if len(g) > 1]
+        
+        for quick in (True, False):  # Files up to two blocks were read whole by the quick hash
+            rehash = lambda f: quick or f["size"] > 2 * QUICK_BLOCK
+            hashes = library.digests([(f["system"], f["name"]) for g in groups for f in g if rehash(f)], quick, self.settings["hash_workers"])
+            split = {}
+            for i, g in enumerate(groups):
+                for f in g:
+                    if rehash(f): f["hash"] = hashes.get((f["system"], f["name"]))  # A file whose SHA-1 failed must not pass on its quick hash
+                    if f["hash"] is not None: split.setdefault((i, f["hash"]), []).append(f)  # Unreadable files drop out
+            groups = [g for g in split.values() if len(g) > 1]
+        
+        out = []
+        for g in groups:
+            g.sort(key=lambda f: (self.rank(f["name"]), f["system"], f["name"]))
+            for f in g: f["path"] = os.path.join(self.settings["roms_dir"], f["system"], f["name"])
+            keep = os.stat(g[0]["path"])
+            g = g[:1] + [f for f in g[1:] if not os.path.samestat(keep, os.stat(f["path"]))]  # Already hardlinked
+            if len(g) > 1: out.append(g)
+        return out
+
+    def clean_identical(self, link=False):  # Remove byte-identical ROMs with preview, or hardlink them to the copy that is kept
+        groups = self.identical(open_library(self.settings), link)
+        if not groups: print("No identical games found."); return
+        
+        print("The following identical games will be processed:")
+        for g in groups:
+            print(f"\033[1m{self._clean_name(g[0]['name'])}:\033[0m \033[33m({format_size(g[0]['size'])})\033[0m")
+            for i, f in enumerate(g):
+                print(f"  \033[36m[{f['system']}]\033[0m {f['name']}")
+                if not i: print("    \033[92m→ Keep:\033[0m Best version")
+                elif link: print(f"    \033[94m→ Link:\033[0m Same content as {g[0]['name']}")
+                else: print(f"    \033[91m→ Delete:\033[0m Same content as {g[0]['name']}")
+            print()
+        saved = sum(g[0]["size"] * (len(g) - 1) for g in groups)
+        print(f"Total: {format_size(saved)} ({sum(len(g) - 1 for g in groups)} files)")
+        
+        confirm = input("Do you want to continue? [Y/n] ")
+        if confirm.lower() not in ["y", "yes", ""]: print("Abort."); return
+        done, failed = 0, 0
+        for g in groups:
+            for f in g[1:]:
+                try:
+                    if link:  # Linked beside the duplicate and renamed over it, the name never disappears
+                        os.link(g[0]["path"], f["path"] + ".link"); os.replace(f["path"] + ".link", f["path"])
+                    else: os.remove(f["path"])
+                    done += 1
+                except OSError as e:
+                    print(f"Error: {f['name']}: {e}"); failed += 1
+        print(f"\033[92m✓ {done}\033[0m duplicates " + ("linked" if link else "removed") + (f", \033[91m✗ {failed}\033[0m failed" if failed else ""))
+
 def main():  # Main CLI entry point
     import sys
 
@@ -664,8 +2063,11 @@ def main():  # Main CLI entry point
         print("  remove      - Remove games")
         print("  list        - List installed games")
         print("  search      - Search available games")
+        print("  dat         - Import a DAT file for checksum verification")
         print("  compress    - Compress ROMs to CHD")
-        print("  autoremove  - Remove duplicates\n")
+        print("  verify      - Check CHD integrity (--force: recheck all, --json: report)")
+        print("  autoremove  - Remove duplicates (--hash: identical files, --link: hardlink them)")
+        print("  rescan      - Re-read size and modification time of every file in the library index\n")
         sys.exit(0)
 
     cmd = sys.argv[1]
@@ -683,30 +2085,38 @@ def main():  # Main CLI entry point
             print("E: Could not load systems.json")
             sys.exit(1)
 
-        if not os.path.exists(os.path.join(mgr.config_dir, "packages.json")):
-            print("E: No package data found. Run 'retro update' first.")
-            sys.exit(1)
+        if sys.argv[2] == "--resume":
+            if sys.argv[3:]:
+                print("E: --resume continues with the options of the interrupted install and takes no other arguments")
+                sys.exit(1)
+            last = mgr.journal.resumable() if mgr.journal else None
+            if not last:
+                print("No interrupted install to resume.")
+                sys.exit(0)
+            job_id, query, pkgs, states, options = last
+            print(f"Resuming \033[1m{query or 'last install'}\033[0m: {len(pkgs)} packages left" + (" (--chd)" if options.get("chd") else ""))
+            mgr.install(pkgs, query, (job_id, states), chd=options.get("chd"))
+            sys.exit(0)
 
-        try:
-            mgr.files = json.load(open(os.path.join(mgr.config_dir, "packages.json")))
-        except Exception as e:
-            print(f"E: Could not load packages.json: {e}")
+        if not mgr.catalog.count():
+            print("E: No package data found. Run 'retro update' first.")
             sys.exit(1)
 
-        query = " ".join(sys.argv[2:])
+        one, chd = True if "--1g1r" in sys.argv[2:] else False if "--all-variants" in sys.argv[2:] else None, "--chd" in sys.argv[2:] or None
+        query = " ".join(a for a in sys.argv[2:] if a not in ("--1g1r", "--all-variants", "--chd"))
         original_input = input
         input_func = lambda prompt: query if "Keywords" in prompt else ""
         import builtins
         builtins.input = input_func
         
-        sel = mgr.search_for_install()
+        sel = mgr.search_for_install(one_game_one_rom=one, chd=chd)
         
         builtins.input = original_input
         
         if sel:
             confirm = input("Do you want to continue? [Y/n] ")
             if confirm.lower() in ["y", "yes", ""]:
-                mgr.install(sel)
+                mgr.install(sel, query, chd=chd)
             else:
                 print("Abort.")
 
@@ -744,24 +2154,58 @@ def main():  # Main CLI entry point
             print("E: Could not load systems.json")
             sys.exit(1)
 
-        if not os.path.exists(os.path.join(mgr.config_dir, "packages.json")):
+        if not mgr.catalog.count():
             print("E: No package data found. Run 'retro update' first.")
             sys.exit(1)
 
+        query_terms, opts = [], {}
+        args = iter(sys.argv[2:])
+        for a in args:
+            if a in ("--limit", "--cursor"): opts[a[2:]] = next(args, "")
+            else: query_terms.append(a)
         try:
-            mgr.files = json.load(open(os.path.join(mgr.config_dir, "packages.json")))
-        except Exception as e:
-            print(f"E: Could not load packages.json: {e}")
+            limit = int(opts["limit"]) if "limit" in opts else None
+            if "cursor" in opts: Query.after(opts["cursor"])
+        except ValueError:
+            print("E: Invalid --limit or --cursor")
             sys.exit(1)
+        mgr.search(query_terms, limit, opts.get("cursor"))
 
-        query_terms = sys.argv[2:]
-        mgr.search(query_terms)
+    elif cmd == "dat":
+        if len(sys.argv) < 4:
+            print("E: Usage: retro dat <system> <file.dat>")
+            sys.exit(1)
+
+        mgr = Manager()
+        if not mgr.load():
+            print("E: Could not load systems.json")
+            sys.exit(1)
+
+        sys_name = sys.argv[2].lower()
+        if sys_name not in mgr.systems:
+            print(f"E: Unknown system {sys_name}")
+            sys.exit(1)
+
+        try: count = mgr.import_dat(sys_name, sys.argv[3])
+        except Exception as e:
+            print(f"E: Could not import DAT: {e}")
+            sys.exit(1)
+        print(f"\033[92m✓\033[0m Imported {count} ROM checksums for \033[36m[{sys_name}]\033[0m")
 
     elif cmd == "compress":
         Converter().auto_compress_all()
 
+    elif cmd == "verify":
+        if not Converter().verify_all(force="--force" in sys.argv[2:], report="--json" in sys.argv[2:]): sys.exit(1)
+
     elif cmd == "autoremove":
-        RomCleaner("W,E,U,J").clean()
+        if "--hash" in sys.argv[2:]: RomCleaner().clean_identical(link="--link" in sys.argv[2:])
+        else: RomCleaner().clean()
+
+    elif cmd == "rescan":
+        settings = load_settings()
+        systems = [x.name for x in os.scandir(settings["roms_dir"]) if x.is_dir()] if os.path.isdir(settings["roms_dir"]) else []
+        print(f"\033[92m✓\033[0m Rescanned {open_library(settings).rescan(systems)} files in {len(systems)} systems")
 
     else:
         print(f"E: Invalid operation {cmd}")
@@ -1,18 +1,26 @@
 """Web-based GUI for Retro - Works on any system!"""
 
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, Response, render_template_string, request, jsonify, stream_with_context
+from concurrent.futures import ThreadPoolExecutor
 import webbrowser
 import threading
-import os
+import itertools
+import json
+import time
 
 try:
-    from retro.main import Manager, format_size
+    from retro.main import Manager, Query, InstallMonitor, format_size
 except ImportError:
-    from main import Manager, format_size
+    from main import Manager, Query, InstallMonitor, format_size
 
 app = Flask(__name__)
 mgr = Manager()
 
+# Installs run as background jobs, at most web_install_jobs at once, and any number of tabs can follow one
+jobs, jobs_lock, job_ids = {}, threading.Lock(), itertools.count(1)
+installer = ThreadPoolExecutor(max_workers=mgr.settings["web_install_jobs"])
+FINISHED = ('done', 'error', 'cancelled')
+
 HTML = '''
 <!DOCTYPE html>
 <html>
@@ -81,6 +89,11 @@ HTML = '''
             color: white;
         }
         .btn-info:hover { background: #2980b9; transform: translateY(-2px); }
+        .btn-danger {
+            background: #c0392b;
+            color: white;
+        }
+        .btn-danger:hover { background: #a93226; transform: translateY(-2px); }
         #output {
             background: #f8f9fa;
             border: 2px solid #e0e0e0;
@@ -131,8 +144,10 @@ HTML = '''
             <div class="search-box">
                 <input type="text" id="searchInput" placeholder="Enter search terms (e.g., 'mario', 'sonic genesis', 'all gba')">
                 <button class="btn-primary" onclick="search()">Search</button>
+                <button class="btn-primary" id="moreBtn" style="display: none" onclick="search(nextCursor)">More</button>
                 <button class="btn-success" onclick="updateDB()">Update Database</button>
                 <button class="btn-info" onclick="listInstalled()">List Installed</button>
+                <button class="btn-danger" id="cancelBtn" style="display: none" onclick="cancelInstall()">Cancel Install</button>
             </div>
             
             <div id="output">
@@ -180,21 +195,51 @@ Examples:
             }
         }
         
-        async function search() {
+        let nextCursor = null, shown = 0, found = 0;
+        
+        function showLine(msg) {
+            const output = document.getElementById('output');
+            if (msg.type === 'error') {
+                output.textContent = msg.output;
+                setStatus(msg.status);
+            } else if (msg.type === 'totals') {
+                found = msg.count;
+                let text = `Found ${msg.count} games (${msg.size_str}):\\n` + '='.repeat(60) + '\\n\\n';
+                for (const [sys, t] of Object.entries(msg.systems)) text += `[${sys}] ${t.size_str} (${t.count} games)\\n`;
+                output.textContent = text + '\\n';
+            } else if (msg.type === 'game') {
+                output.textContent += `  • [${msg.system}] ${msg.name} (${msg.size_str})\\n`;
+                shown++;
+            } else if (msg.type === 'end') {
+                nextCursor = msg.cursor;
+                document.getElementById('moreBtn').style.display = nextCursor ? '' : 'none';
+                setStatus(`Showing ${shown} of ${found} games`);
+            }
+        }
+        
+        async function search(cursor) {
             const query = document.getElementById('searchInput').value.trim();
             if (!query) {
                 alert('Please enter search terms');
                 return;
             }
             setStatus('Searching...');
-            showLoading();
+            if (!cursor) { showLoading(); shown = 0; found = 0; }
             try {
-                const res = await fetch('/api/search?q=' + encodeURIComponent(query));
-                const data = await res.json();
-                document.getElementById('output').textContent = data.output;
-                setStatus(data.status);
+                // Results arrive as one JSON object per line and are shown as they stream in
+                const res = await fetch('/api/search?q=' + encodeURIComponent(query) + (cursor ? '&cursor=' + encodeURIComponent(cursor) : ''));
+                const reader = res.body.getReader(), decoder = new TextDecoder();
+                let buf = '';
+                for (;;) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buf += decoder.decode(value, { stream: true });
+                    const lines = buf.split('\\n');
+                    buf = lines.pop();
+                    for (const line of lines) if (line) showLine(JSON.parse(line));
+                }
                 
-                if (data.count > 0 && confirm(`Install ${data.count} games?`)) {
+                if (!cursor && found > 0 && confirm(`Install ${found} games?`)) {
                     await install(query);
                 }
             } catch(e) {
@@ -203,20 +248,54 @@ Examples:
             }
         }
         
+        let jobId = null, events = null;
+        
         async function install(query) {
             setStatus('Installing...');
             showLoading();
             try {
-                const res = await fetch('/api/install?q=' + encodeURIComponent(query));
+                // The install runs on the server as a job, this only starts it (or joins the same one) and follows its progress
+                const res = await fetch('/api/install?q=' + encodeURIComponent(query), { method: 'POST' });
                 const data = await res.json();
-                document.getElementById('output').textContent = data.output;
-                setStatus(data.status);
+                if (data.job) watch(data.job);
+                else { document.getElementById('output').textContent = data.output; setStatus(data.status); }
             } catch(e) {
                 log('Error: ' + e);
                 setStatus('Error');
             }
         }
         
+        function watch(id) {
+            if (events) events.close();
+            jobId = id;
+            document.getElementById('cancelBtn').style.display = '';
+            events = new EventSource('/api/jobs/' + id + '/events');
+            events.onmessage = (e) => {
+                const job = JSON.parse(e.data);
+                if (job.state === 'queued' || job.state === 'running') {
+                    document.getElementById('output').textContent = `Installing "${job.query}" (${job.total} games)\\n` + '='.repeat(60) + '\\n\\n' +
+                        `Pending: ${job.pending}  Downloading: ${job.downloading}  Extracting: ${job.extracting}  Done: ${job.done}  Failed: ${job.failed}\\n` +
+                        `Downloaded: ${job.bytes_str} at ${job.rate_str}/s`;
+                    setStatus(job.state === 'queued' ? 'Waiting for another install to finish...' : `Installing... ${job.done + job.failed} of ${job.total}`);
+                    return;
+                }
+                events.close(); events = null; jobId = null;
+                document.getElementById('cancelBtn').style.display = 'none';
+                document.getElementById('output').textContent = job.output;
+                setStatus(job.state === 'done' ? 'Ready' : job.state === 'cancelled' ? 'Cancelled' : 'Error');
+            };
+        }
+        
+        async function cancelInstall() {
+            if (jobId && confirm('Cancel the running install?')) await fetch('/api/jobs/' + jobId + '/cancel', { method: 'POST' });
+        }
+        
+        // Follow an install started earlier or in another tab
+        fetch('/api/jobs').then(res => res.json()).then(data => {
+            const active = data.jobs.find(job => job.state === 'queued' || job.state === 'running');
+            if (active) watch(active.id);
+        });
+        
         async function listInstalled() {
             setStatus('Loading...');
             showLoading();
@@ -248,74 +327,127 @@ def index():
 def api_update():
     try:
         mgr.fetch()
-        output = f"✅ Success! Found {len(mgr.files)} games across {len(mgr.systems)} systems"
+        mgr.index  # Build the name index for the new catalog now rather than on the first search
+        output = f"✅ Success! Found {len(mgr.files)} games across {len(mgr.systems)} systems ({len(mgr.changes)} changed)"
         return jsonify({'output': output, 'status': 'Ready', 'count': len(mgr.files)})
     except Exception as e:
         return jsonify({'output': f"❌ Error: {str(e)}", 'status': 'Error', 'count': 0})
 
+def ndjson(lines):
+    return Response(stream_with_context(json.dumps(line) + "\n" for line in lines), mimetype='application/x-ndjson')
+
 @app.route('/api/search')
 def api_search():
     query = request.args.get('q', '')
     if not query:
-        return jsonify({'output': 'No query provided', 'status': 'Error', 'count': 0})
+        return ndjson([{'type': 'error', 'output': 'No query provided', 'status': 'Error'}])
     
-    if not mgr.files:
-        return jsonify({'output': 'No data. Click "Update Database" first.', 'status': 'Error', 'count': 0})
+    if not mgr.catalog.count():
+        return ndjson([{'type': 'error', 'output': 'No data. Click "Update Database" first.', 'status': 'Error'}])
+    if not mgr.systems: mgr.load()
+    
+    try:
+        limit = int(request.args.get('limit', mgr.settings["search_limit"]))
+        cursor = request.args.get('cursor')
+        after = Query.after(cursor) if cursor else None
+    except ValueError:
+        return ndjson([{'type': 'error', 'output': 'Invalid limit or cursor', 'status': 'Error'}])
     
     # Parse and search
     terms = query.split()
-    inc = [t.lower() for t in terms if t.lower() in [s.lower() for s in mgr.systems.keys()]]
-    kw = [t for t in terms if t.lower() not in [s.lower() for s in mgr.systems.keys()] and not t.startswith('-')]
-    exc = [t[1:] for t in terms if t.startswith('-')]
+    q, view = mgr.query(terms), mgr.files
+    ids = q.ids(view, mgr.index)  # In memory, the name index stays loaded between requests
     
-    results = [f for f in mgr.files if 
-              (not inc or f["system"].lower() in inc) and 
-              (not kw or all(k.lower() in f["name"].lower() for k in kw)) and 
-              (not exc or not any(e.lower() in f["name"].lower() for e in exc))]
+    if not ids:
+        return ndjson([{'type': 'error', 'output': 'No games found', 'status': 'Ready'}])
     
-    if not results:
-        return jsonify({'output': 'No games found', 'status': 'Ready', 'count': 0})
+    def lines():
+        # Aggregates first, then one page of ranked games; the full result list never leaves the server
+        totals = view.totals(ids)
+        size = sum(b for _, b in totals.values())
+        yield {'type': 'totals', 'count': len(ids), 'size': size, 'size_str': format_size(size),
+               'systems': {s: {'count': c, 'size': b, 'size_str': format_size(b)} for s, (c, b) in sorted(totals.items())}}
+        shown, last, more = 0, None, None
+        for key, f in q.ranked(view, ids, mgr.settings["preferred_regions"], after, limit + 1 if limit else None):
+            if limit and shown == limit: more = Query.cursor(last); break
+            yield {'type': 'game', 'name': f['name'], 'system': f['system'], 'size': f['size_bytes'], 'size_str': format_size(f['size_bytes'])}
+            shown, last = shown + 1, key
+        yield {'type': 'end', 'shown': shown, 'cursor': more}
     
-    # Format output
-    by_system = {}
-    for f in results:
-        if f["system"] not in by_system:
-            by_system[f["system"]] = []
-        by_system[f["system"]].append(f)
-    
-    output = f"Found {len(results)} games:\n" + "="*60 + "\n\n"
-    for sys_name in sorted(by_system.keys()):
-        files = by_system[sys_name]
-        total = sum(f.get("size_bytes", 0) for f in files)
-        output += f"[{sys_name}] {format_size(total)} ({len(files)} games)\n"
-        for f in files[:20]:
-            output += f"  • {f['name']} ({format_size(f.get('size_bytes', 0))})\n"
-        if len(files) > 20:
-            output += f"  ... and {len(files) - 20} more\n"
-        output += "\n"
-    
-    return jsonify({'output': output, 'status': f'Found {len(results)} games', 'count': len(results), 'results': results})
+    return ndjson(lines())
+
+def snapshot(job):  # JSON state of an install job: stage counters and bytes of the running install
+    stats = job['monitor'].stats
+    snap = {'id': job['id'], 'query': job['query'], 'state': job['state'], 'total': job['total'], 'output': job['output'],
+            'pending': stats.get('pending', job['total']), **{k: stats.get(k, 0) for k in ('downloading', 'extracting', 'done', 'failed', 'bytes')}}
+    snap['bytes_str'] = format_size(snap['bytes'])
+    return snap
+
+def run_install(job):  # Background body of an install job
+    if job['monitor'].cancel.is_set(): return
+    job['state'] = 'running'
+    try:
+        results = mgr.install(job['packages'], job['query'], monitor=job['monitor'])
+        count = lambda kind: sum(1 for r in results if r[0] == kind)
+        cancelled = sum(1 for r in results if r[0] == "error" and r[2] == "cancelled")
+        failed = count('error') + count('mismatch') - cancelled
+        output = ("⏹ Cancelled, installed " if cancelled else "✅ Installed ") + f"{count('done')} games" + (f", {count('skipped')} already installed" if count('skipped') else "") + \
+                 (f", {failed} failed" if failed else "") + (f", {cancelled} not installed ('retro install --resume' continues)" if cancelled else "")
+        if job['saved'] and job['saved'][0]: output += f"\n1G1R: {job['saved'][0]} variants not downloaded, {format_size(job['saved'][1])} saved"
+        job['output'], job['state'] = output, 'cancelled' if job['monitor'].cancel.is_set() else 'done'
+    except Exception as e:
+        job['output'], job['state'] = f"❌ Error: {str(e)}", 'error'
 
-@app.route('/api/install')
+@app.route('/api/install', methods=['GET', 'POST'])
 def api_install():
-    query = request.args.get('q', '')
-    # Re-do search to get packages
-    terms = query.split()
-    inc = [t.lower() for t in terms if t.lower() in [s.lower() for s in mgr.systems.keys()]]
-    kw = [t for t in terms if t.lower() not in [s.lower() for s in mgr.systems.keys()] and not t.startswith('-')]
-    exc = [t[1:] for t in terms if t.startswith('-')]
+    query = " ".join(request.args.get('q', '').split())
+    if not mgr.systems: mgr.load()
+    with jobs_lock:
+        # Another tab asking for the same install follows the running job instead of starting a second one
+        for job in jobs.values():
+            if job['query'] == query and job['state'] not in FINISHED: return jsonify({'job': job['id'], 'status': 'Installing...'})
+        # Re-do search to get packages
+        results = mgr.query(query.split()).run(mgr.files, mgr.index)  # In memory, the name index stays loaded between requests
+        if not results: return jsonify({'output': 'No games found', 'status': 'Ready'})
+        if mgr.settings["one_game_one_rom"]: results = mgr.plan(results)
+        else: mgr.saved = None
+        job = {'id': str(next(job_ids)), 'query': query, 'packages': results, 'total': len(results), 'saved': mgr.saved,
+               'state': 'queued', 'output': '', 'monitor': InstallMonitor()}
+        jobs[job['id']] = job
+        for old in [j for j in jobs.values() if j['state'] in FINISHED][:-20]: del jobs[old['id']]  # Keep the last finished jobs only
+    job['future'] = installer.submit(run_install, job)
+    return jsonify({'job': job['id'], 'status': 'Installing...'})
+
+@app.route('/api/jobs')
+def api_jobs():
+    with jobs_lock: return jsonify({'jobs': [snapshot(job) for job in jobs.values()]})
+
+@app.route('/api/jobs/<job_id>/events')
+def api_job_events(job_id):
+    job = jobs.get(job_id)
+    if not job: return jsonify({'output': 'No such install', 'status': 'Error'}), 404
     
-    results = [f for f in mgr.files if 
-              (not inc or f["system"].lower() in inc) and 
-              (not kw or all(k.lower() in f["name"].lower() for k in kw)) and 
-              (not exc or not any(e.lower() in f["name"].lower() for e in exc))]
+    def events():  # Server-Sent Events: the job state every second until it finishes, with the download rate since the last event
+        last, when = job['monitor'].stats.get('bytes', 0), time.time()
+        while True:
+            snap, now = snapshot(job), time.time()
+            snap['rate'] = (snap['bytes'] - last) / max(now - when, 0.001)
+            snap['rate_str'], last, when = format_size(snap['rate']), snap['bytes'], now
+            yield f"data: {json.dumps(snap)}\n\n"
+            if snap['state'] in FINISHED: return
+            time.sleep(1)
     
-    try:
-        mgr.install(results)
-        output = f"✅ Successfully installed {len(results)} games!"
-        return jsonify({'output': output, 'status': 'Ready'})
-    except Exception as e:
-        return jsonify({'output': f"❌ Error: {str(e)}", 'status': 'Error'})
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    job = jobs.get(job_id)
+    if not job: return jsonify({'output': 'No such install', 'status': 'Error'}), 404
+    job['monitor'].cancel.set()  # A running install stops its downloads and fails the packages left as cancelled
+    if job['state'] == 'queued':  # Not started yet, and it never will
+        job['future'].cancel()
+        job['state'], job['output'] = 'cancelled', 'Install cancelled before it started.'
+    return jsonify(snapshot(job))
 
 @app.route('/api/list')
 def api_list():
@@ -327,19 +459,13 @@ def api_list():
     total_size = 0
     
     for sys_name in sorted(mgr.systems.keys()):
-        sys_dir = os.path.join(mgr.settings["roms_dir"], sys_name)
-        if not os.path.exists(sys_dir):
-            continue
-        
-        files = [f for f in os.listdir(sys_dir) 
-                if os.path.isfile(os.path.join(sys_dir, f)) and not f.startswith('.')]
+        files = list(mgr.library.files(sys_name).items())
         
         if files:
-            sys_size = sum(os.path.getsize(os.path.join(sys_dir, f)) for f in files)
+            sys_size = sum(v[0] for _, v in files)
             output += f"[{sys_name}] {format_size(sys_size)} ({len(files)} games)\n"
-            for f in files[:20]:
-                size = os.path.getsize(os.path.join(sys_dir, f))
-                output += f"  • {f} ({format_size(size)})\n"
+            for f, v in files[:20]:
+                output += f"  • {f} ({format_size(v[0])})\n"
             if len(files) > 20:
                 output += f"  ... and {len(files) - 20} more\n"
             output += "\n"
@@ -365,6 +491,9 @@ def main():
     # Open browser after short delay
     threading.Timer(1.5, lambda: webbrowser.open('http://127.0.0.1:5000')).start()
     
+    # Follow the ROM directories with inotify so /api/list never rescans them
+    if mgr.settings["library_watch"] and mgr.load(): mgr.library.watch(mgr.systems)
+    
     # Start Flask with explicit host
     app.run(debug=False, port=5000, host='127.0.0.1', threaded=True)
 
@@ -28,11 +28,14 @@ setup(
     install_requires=[
         "requests",
         "tqdm",
-        "beautifulsoup4",
         "py7zr",
         "rarfile",
         "flask",
     ],
+    extras_require={
+        "async": ["aiohttp"],
+        "watch": ["inotify_simple"],
+    },
     entry_points={
         "console_scripts": [
             "retro=retro.main:main",